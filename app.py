@@ -1,35 +1,71 @@
 import asyncio
-import base64
+import importlib
 import io
 import json
 import os
 import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
 
-import httpx
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from flask import Flask, make_response, request, send_file
+from flask import Flask, Response, abort, make_response, request, send_file
 from flask_cors import CORS
-from openai import OpenAI
-from PIL import Image
-
-from autocamper import generate_campaign
-
-from autocamper import generate_campaign
 
 load_dotenv()
 
+from autocamper import generate_campaign, warm_geo_target_cache
+from cache import BlobCache, content_key
+from edit_graph import chained_edit_plan, run_edit_plan
+from event_loop import iterate, run
+from images import ImageHandle, ImageStore, contact_sheet
+from instabase import (fetch_image_async, instabase_host, listing_cache,
+                       scrape_listing_async)
+from jobs import JobQueue, QueueFullError
+import llm
+from llm import chat_completion
+from prewarm import Prewarmer
+from singleflight import SingleFlight
+import stability
+from stability import send_generation_request_async
+from trend_index import TrendIndex
+
 app = Flask(__name__)
 CORS(app)
 
-stability_ai_api_host = "https://api.stability.ai"
-stability_ai_api_key = os.getenv("STABILITY_AI_API_KEY")
-
 engine_id = "esrgan-v1-x2plus"
 
-# OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+cache_dir = os.getenv("CACHE_DIR", ".cache")
+
+# Search-and-replace edits use a fixed seed, so their output is a pure
+# function of the input image and parameters and can be cached by content.
+edit_cache_enabled = os.getenv("EDIT_CACHE_ENABLED", "1") == "1"
+edit_cache = BlobCache(
+    os.path.join(cache_dir, "edits"),
+    max_memory_bytes=int(os.getenv("EDIT_CACHE_MEMORY_MB", "128")) << 20,
+    max_disk_bytes=int(os.getenv("EDIT_CACHE_DISK_MB", "2048")) << 20)
+
+# Images fetched by /venue and produced by /edit and /upscale, so that clients
+# can pass an `image_id` instead of uploading the image again
+image_store = ImageStore(
+    BlobCache(os.path.join(cache_dir, "images"),
+              max_memory_bytes=int(os.getenv("IMAGE_STORE_MEMORY_MB", "64"))
+              << 20,
+              max_disk_bytes=int(os.getenv("IMAGE_STORE_DISK_MB", "1024"))
+              << 20),
+    source_ttl=float(os.getenv("IMAGE_STORE_SOURCE_TTL", "3600")))
+
+# How candidate edits are shown to GPT-4V by `select_best_image`:
+# `per_image` sends the original and every edit as separate images,
+# `contact_sheet` sends a single labeled grid of all of them.
+selection_mode = os.getenv("SELECTION_MODE", "per_image")
+
+# Shape of the edit graph: round 1 applies every prompt to the original
+# image, and each later round applies prompt (i + offset) to every edit whose
+# last prompt was i.
+edit_rounds = int(os.getenv("EDIT_ROUNDS", "2"))
+edit_chain_offset = int(os.getenv("EDIT_CHAIN_OFFSET", "1"))
 
 
 ib_trends = [
@@ -43,37 +79,14 @@ ib_trends = [
     "Pizza Party",
 ]
 
+# Identical /venue and /edit requests in flight at the same time share one
+# computation
+in_flight = SingleFlight()
 
-def scrape_listing(room_id):
-    url = "https://www.instabase.jp" + "/space/" + str(room_id)
-
-    r = requests.get(url + "/images")
-    if r.status_code != 200:
-        return None, []
-
-    soup = BeautifulSoup(r.text, 'html.parser')
-
-    dirs = filter(lambda x: x.startswith("/imgs/r/uploads/room_image/image/"),
-                  [
-                      img['src'].replace('medium', 'large')
-                      for img in soup.find_all('img')
-                  ])
-    dirs = list(dict.fromkeys(dirs))
-
-    r = requests.get(url)
-    if r.status_code != 200:
-        return None, []
-
-    soup = BeautifulSoup(r.text, 'html.parser')
-
-    title = soup.find('h2', {'class': 'text-xl'}).text
-
-    div = soup.find_all('div', {'class': 'mt-6'})[2]
-    tags = [i.text for i in div.find_all('button')]
-
-    return title, [
-        "https://www.instabase.jp" + directory for directory in list(dirs)
-    ], tags
+# Verdicts of which `ib_trends` each venue can host, so that /venue only asks
+# the LLM about trends it has not judged for the venue's current photo yet.
+trend_index = TrendIndex(
+    os.getenv("TREND_INDEX_PATH", os.path.join(cache_dir, "trends.sqlite3")))
 
 
 def search_and_replace_function_call_prompt(long_text: str) -> str:
@@ -90,7 +103,7 @@ def search_and_replace_function_call_prompt(long_text: str) -> str:
     '''
 
 
-def get_search_and_replace_prompts(trend, image):
+async def get_search_and_replace_prompts(trend, image, use_cache=True):
     prompt = f"""
     You are an AI that has the function
     `search_and_replace(search_prompt, replace_prompt)`. The function operates
@@ -104,7 +117,7 @@ def get_search_and_replace_prompts(trend, image):
     """
 
     # Call the GPT-4V model
-    response = client.chat.completions.create(
+    response = await chat_completion(
         model="gpt-4-vision-preview",
         messages=[{
             "role": "system",
@@ -118,11 +131,12 @@ def get_search_and_replace_prompts(trend, image):
             }, {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{image}"
+                    "url": image.data_url()
                 }
             }]
         }],
-        max_tokens=2000)
+        max_tokens=2000,
+        use_cache=use_cache)
     description = response.choices[0].message.content
     print(description)
 
@@ -158,12 +172,13 @@ def get_search_and_replace_prompts(trend, image):
             "required": ['search_prompts', 'replace_prompts'],
         }
     }]
-    response = client.chat.completions.create(
+    response = await chat_completion(
         model='gpt-3.5-turbo',
         messages=fn_call_messages,
         seed=42,
         functions=functions,
-        function_call={"name": 'search_and_replace_all'})
+        function_call={"name": 'search_and_replace_all'},
+        use_cache=use_cache)
     # For type checking
     assert response.choices[0].message.function_call is not None
     function_args = json.loads(
@@ -177,58 +192,9 @@ def get_search_and_replace_prompts(trend, image):
     return search_prompts, replace_prompts
 
 
-def encode_image_bytes(image_bytes):
-    return base64.b64encode(image_bytes).decode('utf-8')
-
-
-def downscale_image(image_base64, scale_factor):
-    # Convert the base64 string to a PIL image
-    img_data = base64.b64decode(image_base64)
-    img = Image.open(io.BytesIO(img_data))
-
-    # Calculate the new size
-    width, height = img.size
-    new_size = (int(width * scale_factor), int(height * scale_factor))
-
-    # Resize the image
-    img_resized = img.resize(new_size, Image.Resampling.LANCZOS)
-
-    # Convert the image to RGB if it's RGBA
-    if img_resized.mode == 'RGBA':
-        img_resized = img_resized.convert('RGB')
-
-    # Convert the PIL image back to a base64 string
-    buffered = io.BytesIO()
-    img_resized.save(buffered, format="JPEG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-
-    return img_str
-
-
-async def send_generation_request_async(host, params, image):
-    headers = {
-        "Accept": "image/*",
-        "Authorization": f"Bearer {stability_ai_api_key}"
-    }
-
-    # Encode parameters
-    files = {'image': image}
-
-    # Send request
-    print(f"Sending REST request to {host}...")
-    timeout = httpx.Timeout(30.0, connect=60.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        response = await client.post(host,
-                                     headers=headers,
-                                     files=files,
-                                     data=params)
-        if not response.is_success:
-            raise Exception(f"HTTP {response.status_code}: {response.text}")
-        return response
-
-
-async def edit_single_image(input_image, prompt, search_prompt):
-    host = "https://api.stability.ai/v2beta/stable-image/edit/search-and-replace"
+async def edit_single_image(input_image, prompt, search_prompt,
+                            use_cache=True):
+    host = "/v2beta/stable-image/edit/search-and-replace"
     negative_prompt = ""
     seed = 0
     output_format = "jpeg"
@@ -240,7 +206,17 @@ async def edit_single_image(input_image, prompt, search_prompt):
         "negative_prompt": negative_prompt,
         "search_prompt": search_prompt,
     }
-    response = await send_generation_request_async(host, params, input_image)
+    # With `use_cache=False` the cached result is ignored but refreshed
+    cache_key = content_key(host, json.dumps(params, sort_keys=True),
+                            input_image.data)
+    if edit_cache_enabled and use_cache:
+        cached = await asyncio.to_thread(edit_cache.get, cache_key)
+        if cached is not None:
+            print(f"Using cached edit for search prompt '{search_prompt}'")
+            return ImageHandle(cached)
+
+    response = await send_generation_request_async(host, params,
+                                                   input_image.data)
     # Decode response
     output_image = response.content
     finish_reason = response.headers.get("finish-reason")
@@ -250,11 +226,18 @@ async def edit_single_image(input_image, prompt, search_prompt):
     if finish_reason == 'CONTENT_FILTERED':
         raise Warning("Generation failed NSFW classifier")
 
+    await asyncio.to_thread(save_edit, f"edited_{seed}.{output_format}",
+                            cache_key, output_image)
+    return ImageHandle(output_image)
+
+
+def save_edit(edited, cache_key, output_image):
     # Save result for debugging
-    edited = f"edited_{seed}.{output_format}"
     with open(edited, "wb") as f:
         f.write(output_image)
-    return output_image
+
+    if edit_cache_enabled:
+        edit_cache.put(cache_key, output_image)
 
 
 def select_best_image_function_call_prompt(long_text, available_image_names,
@@ -271,7 +254,7 @@ def select_best_image_function_call_prompt(long_text, available_image_names,
     '''
 
 
-def select_best_image(original_image, edited_dict, trend):
+def per_image_selection_content(thumbnails, trend):
     user_prompt = f"""
     You are an expert at assessing the quality of edited images. The first image
     is the original image of the venue (`original_image`), and the subsequent
@@ -291,22 +274,68 @@ def select_best_image(original_image, edited_dict, trend):
     images_list = [{
         "type": "image_url",
         "image_url": {
-            "url":
-            f"data:image/jpeg;base64,{downscale_image(original_image, 0.25)}"
+            "url": thumbnail.data_url()
+        }
+    } for thumbnail in thumbnails]
+    return [{"type": "text", "text": user_prompt}] + images_list
+
+
+def contact_sheet_selection_content(sheet, trend):
+    user_prompt = f"""
+    You are an expert at assessing the quality of edited images. The image is a
+    grid of labeled photos of a venue: the one labeled `original_image` is the
+    original photo, and the ones labeled `edited_image_1`, `edited_image_2`, etc.
+    are edited images that are intended to show the venue being used for a {trend}.
+
+    Determine which edited image is the most appropriate. Consider factors such as
+    the general quality of the image and how realistic it looks, whether it is a
+    realistic edit of the original image, and whether it convincingly looks like the
+    venue is being used for a {trend}.
+
+    After explaining your reasoning, specify which edited image is the best choice
+    by the label printed below it.
+    """
+
+    return [{
+        "type": "text",
+        "text": user_prompt
+    }, {
+        "type": "image_url",
+        "image_url": {
+            "url": sheet.data_url()
         }
     }]
-    for _, edited_image in edited_dict.items():
-        images_list.append({
-            "type": "image_url",
-            "image_url": {
-                "url":
-                f"data:image/jpeg;base64,{downscale_image(encode_image_bytes(edited_image), 0.25)}"
-            }
-        })
+
+
+async def select_best_image(original_image,
+                            edited_dict,
+                            trend,
+                            use_cache=True,
+                            mode=None):
+    mode = mode or selection_mode
+    thumbnails = await asyncio.gather(
+        *(image.downscaled_async(0.25)
+          for image in [original_image, *edited_dict.values()]))
+    available_image_names = [
+        f"edited_image_{i}" for i in range(1,
+                                           len(edited_dict) + 1)
+    ]
+
+    content = None
+    if mode == 'contact_sheet':
+        try:
+            sheet = await asyncio.to_thread(
+                contact_sheet, thumbnails,
+                ['original_image'] + available_image_names)
+            content = contact_sheet_selection_content(sheet, trend)
+        except Exception as e:
+            print(f'Falling back to per-image selection: {e}')
+    if content is None:
+        content = per_image_selection_content(thumbnails, trend)
+
     print(f'Evaluating the best out of {len(edited_dict)} images...')
-    content = [{"type": "text", "text": user_prompt}] + images_list
     # Call the GPT-4V model
-    response = client.chat.completions.create(
+    response = await chat_completion(
         model="gpt-4-vision-preview",
         messages=[{
             "role": "system",
@@ -314,16 +343,13 @@ def select_best_image(original_image, edited_dict, trend):
         }, {
             "role": "user",
             "content": content
-        }])
+        }],
+        use_cache=use_cache)
     description = response.choices[0].message.content
     print(description)
 
     # Call the GPT-4-Turbo model using function calling to get a structured
     # response
-    available_image_names = [
-        f"edited_image_{i}" for i in range(1,
-                                           len(edited_dict) + 1)
-    ]
     fn_call_messages = [{
         "role":
         "user",
@@ -346,12 +372,13 @@ def select_best_image(original_image, edited_dict, trend):
             "required": ['edited_image_name'],
         },
     }]
-    response = client.chat.completions.create(
+    response = await chat_completion(
         model='gpt-3.5-turbo',
         messages=fn_call_messages,
         seed=42,
         functions=functions,
-        function_call={"name": 'save_best_edited_image'})
+        function_call={"name": 'save_best_edited_image'},
+        use_cache=use_cache)
     # For type checking
     assert response.choices[0].message.function_call is not None
     function_args = json.loads(
@@ -367,7 +394,7 @@ def select_best_image(original_image, edited_dict, trend):
     return edited_dict[key]
 
 
-def select_relevant_trends(trends, image_url):
+async def select_relevant_trends(trends, image_url, use_cache=True):
     user_prompt = f"""
     You are an expert at assessing whether the following events: {trends} could be hosted at a venue. You will be given\
     an image of the venue. For each possible event, you are to explain why that event could or could not be hosted \
@@ -387,7 +414,7 @@ def select_relevant_trends(trends, image_url):
     print(f'Starting to check viability of trends for venue')
     content = [{"type": "text", "text": user_prompt}] + image
     # Call the GPT-4V model
-    response = client.chat.completions.create(
+    response = await chat_completion(
         model="gpt-4-vision-preview",
         messages=[{
             "role": "system",
@@ -395,15 +422,18 @@ def select_relevant_trends(trends, image_url):
         }, {
             "role": "user",
             "content": content
-        }])
+        }],
+        use_cache=use_cache)
     description = response.choices[0].message.content
     print(description)
 
     return description.split('\n')[-1].replace("*", "").replace("\"", "").split(',')
 
     
-def simple_prompt(prompt, sys_prompt="You are a helpful assistant."):
-    response = client.chat.completions.create(
+async def simple_prompt(prompt,
+                        sys_prompt="You are a helpful assistant.",
+                        use_cache=True):
+    response = await chat_completion(
         model="gpt-3.5-turbo",
         messages=[{
             "role": "system",
@@ -412,7 +442,8 @@ def simple_prompt(prompt, sys_prompt="You are a helpful assistant."):
             "role": "user",
             "content": prompt,
         }],
-        max_tokens=100)
+        max_tokens=100,
+        use_cache=use_cache)
 
     print(response.choices[0].message)
 
@@ -421,81 +452,401 @@ def simple_prompt(prompt, sys_prompt="You are a helpful assistant."):
 
 @app.route('/venue/<venueid>', methods=['GET'])
 def venue(venueid):
-    title, urls, tags = scrape_listing(venueid)
+    return run(shared_venue_async(venueid, use_cache_requested()))
+
+
+async def shared_venue_async(venueid, use_cache=True, max_age=None):
+    key = ('venue', str(venueid).strip(), use_cache, max_age)
+    return await in_flight.do(
+        key, lambda: venue_async(venueid, use_cache, max_age))
+
+
+async def venue_async(venueid, use_cache=True, max_age=None):
+    """`max_age` bounds the age of the cached listing that is used without
+    revalidating it, e.g. 0 to always revalidate. When it is set, the stored
+    photo is also kept as long as the listing's first image URL is unchanged,
+    as instabase uploads never change in place."""
+    title, urls, tags = await scrape_listing_async(venueid, max_age)
+    first_image = await fetch_source_image(urls[0],
+                                           renew=max_age is not None)
+    trends = await venue_trends(venueid, urls[0], first_image, use_cache)
+
+    return {'title': title, 'urls': urls[:3], 'tags': tags, 'trends': trends, 'ib_trends': ib_trends,
+            'image_ids': {urls[0]: first_image.digest}}
+
+
+async def fetch_source_image(url, renew=False):
+    """Returns the image at `url`, registered in `image_store`."""
+    image = await asyncio.to_thread(image_store.get_source, url, renew)
+    if image is None:
+        image = ImageHandle(await fetch_image_async(url))
+        await asyncio.to_thread(image_store.put, image, url)
+    return image
+
+
+async def venue_trends(venueid, image_url, image, use_cache=True):
+    """Returns the trends in `ib_trends` that the venue can host, judged from
+    its first image. With `use_cache=False` every trend is re-evaluated."""
+    image_hash = image.digest
+    if use_cache:
+        viable, missing = await asyncio.to_thread(trend_index.lookup, venueid,
+                                                  image_hash, ib_trends)
+    else:
+        viable, missing = [], ib_trends
+
+    if missing:
+        selected = await select_relevant_trends(missing, image_url, use_cache)
+        selected = {trend.strip().lower() for trend in selected} - {''}
+        newly_viable = [trend for trend in missing if trend.lower() in selected]
+        # A last line that names none of the trends is more likely a
+        # formatting slip than a verdict, so it is not stored unless it is an
+        # explicitly empty list
+        if newly_viable or selected <= {'none', '[]'}:
+            await asyncio.to_thread(trend_index.store, venueid, image_hash,
+                                    missing, newly_viable)
+        viable = viable + newly_viable
+
+    return [trend for trend in ib_trends if trend in viable]
+
+
+# Heavy dependencies are imported by the code that needs them rather than at
+# startup. `/ready?warm=1` imports them ahead of the first real request.
+lazy_modules = [
+    "httpx",
+    "openai",
+    "bs4",
+    "PIL.Image",
+    "google.ads.googleads.client",
+]
 
-    return {'title': title, 'urls': urls[:3], 'tags': tags, 'trends': select_relevant_trends(ib_trends, urls[0]), 'ib_trends': ib_trends}
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    if request.args.get('warm') != '1':
+        return {'ready': True}
+
+    started_at = time.perf_counter()
+    for name in lazy_modules:
+        importlib.import_module(name)
+    return {
+        'ready': True,
+        'warmed': lazy_modules,
+        'seconds': time.perf_counter() - started_at,
+    }
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return {
+        'listing_cache': listing_cache.stats(),
+        'edit_cache': edit_cache.stats(),
+        'jobs': job_queue.stats(),
+        'stability': stability.stats(),
+        'llm_cache': llm.cache_stats(),
+        'trend_index': trend_index.stats(),
+        'prewarm': prewarmer.stats(),
+        'in_flight': in_flight.stats(),
+        'image_store': image_store.stats(),
+    }
 
 
 @app.route('/edit', methods=['GET', 'POST'])
 def edit():
     # This is a wrapper function to handle synchronous Flask route
-    return asyncio.run(edit_async())
+    best_edited_image = run(
+        shared_edit_async(request_image(), request_field('trend'),
+                          use_cache_requested()))
+    image_store.put(best_edited_image)
+    return image_response(best_edited_image)
 
 
-async def edit_async():
-    original_image = request.json['images']
-    trend = request.json['trend']
-    search_prompts, replace_prompts = get_search_and_replace_prompts(
-        trend, original_image)
-    print(f'Search prompts: {search_prompts}')
-    print(f'Replace prompts: {replace_prompts}')
+def is_binary_request():
+    return request.mimetype.startswith('image/') or request.files
 
-    original_image_bytes = base64.decodebytes(bytes(original_image, 'utf-8'))
 
-    # First round (prompt_0, prompt_1, prompt_2)
-    first_round_tasks = [
-        edit_single_image(original_image_bytes, rp, sp)
-        for rp, sp in zip(replace_prompts, search_prompts)
-    ]
-    first_round_results = await asyncio.gather(*first_round_tasks)
-    # Store first round results in edited_dict
-    edited_dict = {
-        f'{i}': result
-        for i, result in enumerate(first_round_results)
+def request_image():
+    """Returns the input image of `/edit` and `/upscale` requests.
+
+    Images are accepted as a raw `image/*` body, as the `image` file of a
+    multipart form, base64 encoded in the `images` field of a JSON body, or by
+    reference: the `image_id` of a stored image or the instabase `source_url`
+    it was published at (in the JSON body, form or query string).
+    """
+    body = request.get_json(silent=True) or {}
+    image_id = body.get('image_id') or request.values.get('image_id')
+    if image_id:
+        return stored_image(image_id)
+    source_url = body.get('source_url') or request.values.get('source_url')
+    if source_url:
+        parts = urlsplit(source_url)
+        if (f'{parts.scheme}://{parts.netloc}' != instabase_host
+                or not parts.path.startswith('/imgs/')):
+            abort(make_response(
+                {'error': 'source_url must be an instabase image'}, 400))
+        return run(fetch_source_image(source_url))
+    if request.mimetype.startswith('image/'):
+        return ImageHandle(request.get_data(), request.mimetype)
+    if 'image' in request.files:
+        upload = request.files['image']
+        if upload.mimetype.startswith('image/'):
+            return ImageHandle(upload.read(), upload.mimetype)
+        return ImageHandle(upload.read())
+    return ImageHandle.from_base64(request.json['images'])
+
+
+def request_field(name):
+    """Returns a field of the JSON body, falling back to the form or query
+    string."""
+    value = (request.get_json(silent=True) or {}).get(name)
+    if value is None:
+        value = request.values[name]
+    return value
+
+
+def stored_image(image_id):
+    image = None
+    if re.fullmatch('[0-9a-f]{64}', image_id):
+        image = image_store.get(image_id)
+    if image is None:
+        abort(make_response({'error': f'Unknown image {image_id}'}, 404))
+    return image
+
+
+def image_response(image):
+    """Responds with the raw image for binary requests and clients that
+    prefer `image/*`, and with base64 in JSON otherwise. Either way the
+    response carries the `image_id` the image is stored under."""
+    offers = ['application/json', image.mime_type]
+    if is_binary_request():
+        offers.reverse()
+    if (request.accept_mimetypes.best_match(offers, default=offers[0]) ==
+            image.mime_type):
+        response = send_file(io.BytesIO(image.data), mimetype=image.mime_type)
+        response.headers['X-Image-Id'] = image.digest
+        return response
+    return {'image': image.base64(), 'image_id': image.digest}
+
+
+@app.route('/images/<image_id>', methods=['GET'])
+def get_image(image_id):
+    image = stored_image(image_id)
+    response = send_file(io.BytesIO(image.data), mimetype=image.mime_type)
+    # Ids are content hashes, so the image behind an id never changes
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def use_cache_requested():
+    """Clients can bypass result caches with `"no_cache": true` in the JSON
+    body, `no_cache=1` in the form or query string or a
+    `Cache-Control: no-cache` header."""
+    if 'no-cache' in request.headers.get('Cache-Control', ''):
+        return False
+    no_cache = (request.get_json(silent=True) or {}).get('no_cache')
+    if no_cache is None:
+        no_cache = request.values.get('no_cache') in ('1', 'true')
+    return not no_cache
+
+
+@app.route('/edit/stream', methods=['GET', 'POST'])
+def edit_stream():
+    """Same as `/edit`, but streams progress as Server-Sent Events: the
+    generated prompts, every edited image as soon as it is ready and finally
+    the selected image."""
+    events = edit_events(request_image(), request_field('trend'),
+                         use_cache_requested())
+    return Response(format_sse_events(iterate(events)),
+                    mimetype='text/event-stream',
+                    headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no'
+                    })
+
+
+def format_sse_events(events):
+    try:
+        for event, data in events:
+            if 'image' in data:
+                data = {**data, 'image': data['image'].base64()}
+            yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+    except Exception as e:
+        print(f'Streaming edit failed: {e}')
+        yield f'event: error\ndata: {json.dumps({"message": str(e)})}\n\n'
+
+
+async def shared_edit_async(original_image, trend, use_cache=True):
+    key = ('edit', content_key(original_image.digest, trend), use_cache)
+    return await in_flight.do(
+        key, lambda: edit_async(original_image, trend, use_cache))
+
+
+async def edit_async(original_image, trend, use_cache=True):
+    async for event, data in edit_events(original_image, trend, use_cache):
+        if event == 'best':
+            best_edited_image = data['image']
+
+    return best_edited_image
+
+
+async def edit_events(original_image, trend, use_cache=True):
+    """Runs the edit pipeline, yielding `(event, data)` tuples as it goes.
+
+    Events are `prompts` with the generated search/replace prompts, `edit`
+    with the `key` and `ImageHandle` `image` of each finished edit, and `best`
+    with the `ImageHandle` `image` picked by `select_best_image`.
+    """
+    search_prompts, replace_prompts = await get_search_and_replace_prompts(
+        trend, original_image, use_cache)
+    print(f'Search prompts: {search_prompts}')
+    print(f'Replace prompts: {replace_prompts}')
+    yield 'prompts', {
+        'search_prompts': search_prompts,
+        'replace_prompts': replace_prompts
     }
 
-    # Second round (prompt_0 -> prompt_1, prompt_1 -> prompt_2, prompt_2 -> prompt_0)
-    num_prompts = len(search_prompts)
-    second_round_tasks = [
-        edit_single_image(edited_dict[f'{i}'],
-                          replace_prompts[(i + 1) % num_prompts],
-                          search_prompts[(i + 1) % num_prompts])
-        for i in range(num_prompts)
-    ]
-    second_round_results = await asyncio.gather(*second_round_tasks)
-    # Store second round results in edited_dict
-    for i, result in enumerate(second_round_results):
-        edited_dict[f'{i}->{(i + 1) % num_prompts}'] = result
+    async def apply_prompt(input_image, prompt_index):
+        return await edit_single_image(input_image,
+                                       replace_prompts[prompt_index],
+                                       search_prompts[prompt_index], use_cache)
+
+    # Each edit starts as soon as the edit it builds on has finished
+    plan = chained_edit_plan(len(search_prompts), edit_rounds,
+                             edit_chain_offset)
+    finished = asyncio.Queue()
+    edits = asyncio.ensure_future(
+        run_edit_plan(plan, original_image, apply_prompt,
+                      lambda key, image: finished.put_nowait((key, image))))
+    edits.add_done_callback(lambda _: finished.put_nowait(None))
+    try:
+        while (item := await finished.get()) is not None:
+            key, image = item
+            yield 'edit', {'key': key, 'image': image}
+        edited_dict = edits.result()
+    finally:
+        edits.cancel()
 
     # Select the best image
-    best_edited_image = select_best_image(original_image, edited_dict, trend)
+    best_edited_image = await select_best_image(original_image, edited_dict,
+                                                trend, use_cache)
 
-    return {'image': base64.b64encode(best_edited_image).decode('utf-8')}
+    yield 'best', {'image': best_edited_image}
 
 
 @app.route('/upscale', methods=['GET', 'POST'])
 def upscale():
-    response = requests.post(
-        f"{stability_ai_api_host}/v1/generation/{engine_id}/image-to-image/upscale",
-        headers={
-            "Accept": "image/png",
-            "Authorization": f"Bearer {stability_ai_api_key}"
-        },
-        files={
-            "image": base64.decodebytes(bytes(request.json['images'], 'utf-8'))
-        },
-        data={
-            "width": 1024,
-        })
-
-    if response.status_code != 200:
-        print(str(response.text))
+    original_image = request_image()
+    try:
+        upscaled_image = run(upscale_async(original_image))
+        image_store.put(upscaled_image)
+        return image_response(upscaled_image)
+    except Exception as e:
+        print(str(e))
         return None
 
+
+async def upscale_async(original_image):
+    response = await send_generation_request_async(
+        f"/v1/generation/{engine_id}/image-to-image/upscale",
+        {"width": 1024},
+        original_image.data,
+        accept="image/png")
+
     # with open("out.jpeg", "wb") as fd:
     #     fd.write(response.content)
 
-    return {'image': base64.b64encode(response.content).decode('utf-8')}
+    return ImageHandle(response.content, "image/png")
+
+
+def stored_result(image):
+    return {'image': image.base64(), 'image_id': image_store.put(image)}
+
+
+# Background jobs: `/jobs/edit` and `/jobs/upscale` take the same bodies as
+# `/edit` and `/upscale`, and the result is polled from `/jobs/<job_id>`.
+job_queue = JobQueue(
+    os.getenv("JOBS_DB_PATH", os.path.join(cache_dir, "jobs.sqlite3")), {
+        'edit':
+        lambda payload: stored_result(
+            run(
+                shared_edit_async(ImageHandle.from_base64(payload['images']),
+                                  payload['trend'],
+                                  payload.get('use_cache', True)))),
+        'upscale':
+        lambda payload: stored_result(
+            run(upscale_async(ImageHandle.from_base64(payload['images'])))),
+    },
+    num_workers=int(os.getenv("JOB_WORKERS", "2")),
+    max_queued=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+    retention=float(os.getenv("JOB_RETENTION", "3600")),
+    lease=float(os.getenv("JOB_LEASE", "60")))
+
+
+# Venues whose /venue data is kept warm in the background. Each crawl
+# revalidates the cached listing and renews the stored photo (downloading it
+# only when the listing points to a new one), so that neither is stale for
+# foreground requests; freshness lag is the age of the cached listing.
+prewarmer = Prewarmer(
+    lambda venueid: shared_venue_async(venueid, max_age=0),
+    lambda venueid: listing_cache.age(str(venueid)),
+    [
+        venue_id.strip()
+        for venue_id in os.getenv("PREWARM_VENUES", "").split(",")
+        if venue_id.strip()
+    ],
+    interval=float(os.getenv("PREWARM_INTERVAL", "240")),
+    max_concurrency=int(os.getenv("PREWARM_CONCURRENCY", "2")),
+    rate=float(os.getenv("PREWARM_RATE", "0.5")))
+
+
+# Resolve the default geo targets in the background so that the first
+# campaign creation does not wait for the lookup
+geo_target_warmup = os.getenv("GEO_TARGET_WARMUP", "1") == "1"
+geo_target_warmup_lock = threading.Lock()
+geo_target_warmup_started = False
+
+
+@app.before_request
+def start_background_workers():
+    # Started on the first request rather than at import time, so that only
+    # the serving process (not e.g. the reloader parent) runs workers.
+    global geo_target_warmup_started
+    job_queue.start()
+    prewarmer.start()
+    with geo_target_warmup_lock:
+        start_warmup = geo_target_warmup and not geo_target_warmup_started
+        geo_target_warmup_started = True
+    if start_warmup:
+        threading.Thread(target=warm_geo_target_cache, daemon=True).start()
+
+
+@app.route('/jobs/edit', methods=['POST'])
+def submit_edit_job():
+    return submit_job('edit', {
+        'images': request_image().base64(),
+        'trend': request_field('trend'),
+        'use_cache': use_cache_requested(),
+    })
+
+
+@app.route('/jobs/upscale', methods=['POST'])
+def submit_upscale_job():
+    return submit_job('upscale', {'images': request_image().base64()})
+
+
+def submit_job(kind, payload):
+    try:
+        job_id = job_queue.submit(kind, payload)
+    except QueueFullError as e:
+        return {'error': str(e)}, 503
+    return {'job_id': job_id, 'state': 'queued'}, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {'error': f'Unknown job {job_id}'}, 404
+    return job
 
 
 @app.route('/gen-campaign', methods=['GET', 'POST'])
@@ -505,39 +856,51 @@ def gen_campaign():
     trend = request.json['trend']
     budget = request.json['budget']
 
-    headlines = [hl.replace("!", "").strip() for hl in simple_prompt(
-        f"""Please make 3 unique 4 word headlines to get people to click on my link based on the following data: 
+    headlines, descriptions, keywords = run(
+        generate_ad_copy(trend, tags, use_cache_requested()))
+
+    generate_campaign(ib_id,
+                      budget,
+                      headlines,
+                      descriptions,
+                      keywords,
+                      geo_locations=request.json.get('geo_locations'))
+
+    return {"headlines": headlines, "descriptions": descriptions, "keywords": keywords}
+
+
+async def generate_ad_copy(trend, tags, use_cache=True):
+    # The three prompts are independent, so they are issued concurrently
+    headlines, descriptions, keywords = await asyncio.gather(
+        simple_prompt(
+            f"""Please make 3 unique 4 word headlines to get people to click on my link based on the following data: 
                         {trend}, {tags}. Each headline should be the only text on it's own line with no leading number.
                         """,
-        "You are a search engine optimization assistant."
-    ).content.split("\n")]
+            "You are a search engine optimization assistant.", use_cache),
+        simple_prompt(
+            f"""Please make 2 unique 15 word descriptions to get people to click on my link based on the following data:  
+                        {trend}, {tags}. Each description should be the only text on it's own line with no leading number.
+                        """,
+            "You are a search engine optimization assistant.", use_cache),
+        simple_prompt(
+            f"""Generate 10 popular english search keywords that would help google searches find my listing based on the following terms:  
+                            {trend}, {tags}. Each keyword should be the only text on it's own line with no leading number.
+                            """,
+            "Output only the terms.", use_cache))
 
+    headlines = [hl.replace("!", "").strip() for hl in headlines.content.split("\n")]
     headlines = [hl if len(hl) < 30 else hl[:28] for hl in headlines]
     headlines = [hl for hl in headlines if hl != ""]
 
-    descriptions = [hl.replace("!", "").strip() for hl in simple_prompt(
-        f"""Please make 2 unique 15 word descriptions to get people to click on my link based on the following data:  
-                        {trend}, {tags}. Each description should be the only text on it's own line with no leading number.
-                        """,
-        "You are a search engine optimization assistant."
-    ).content.split("\n")]
-
+    descriptions = [hl.replace("!", "").strip() for hl in descriptions.content.split("\n")]
     descriptions = [desc if len(desc) < 70 else desc[:68] for desc in descriptions]
     descriptions = [desc for desc in descriptions if desc != ""]
 
-    keywords = [hl.replace("!", "").strip() for hl in simple_prompt(
-        f"""Generate 10 popular english search keywords that would help google searches find my listing based on the following terms:  
-                            {trend}, {tags}. Each keyword should be the only text on it's own line with no leading number.
-                            """,
-        "Output only the terms."
-    ).content.split("\n")]
-
+    keywords = [hl.replace("!", "").strip() for hl in keywords.content.split("\n")]
     keywords = [keyword if len(keyword) < 50 else keyword[:48] for keyword in keywords]
     keywords = [kw for kw in keywords if kw != ""]
 
-    generate_campaign(ib_id, budget, headlines, descriptions, keywords)
-
-    return {"headlines": headlines, "descriptions": descriptions, "keywords": keywords}
+    return headlines, descriptions, keywords
 
   
 if __name__ == '__main__':
@@ -22,15 +22,70 @@ More details on Responsive Search ads can be found here:
 https://support.google.com/google-ads/answer/7684791
 """
 
+import json
 import os
-from google.ads.googleads.client import GoogleAdsClient
+import threading
+import weakref
 import uuid
 
-os.environ["GOOGLE_ADS_CONFIGURATION_FILE_PATH"] = "./google_ads.yaml"
+os.environ.setdefault("GOOGLE_ADS_CONFIGURATION_FILE_PATH", "./google_ads.yaml")
 CUSTOMER_ID = "6460230654"
-
-
-def generate_campaign(ib_id=1234511267, cost=500, headlines=None, descriptions=None, keywords=None, client=GoogleAdsClient.load_from_storage(version="v16"), customer_id=CUSTOMER_ID):
+API_VERSION = "v16"
+
+# The client is loaded on first use rather than at import time, and service
+# clients (each of which owns a gRPC channel) are reused across calls.
+_client = None
+_client_lock = threading.Lock()
+_services = weakref.WeakKeyDictionary()
+_services_lock = threading.Lock()
+
+# Geo targeting used when a campaign does not specify its own locations.
+GEO_LOCATIONS = ["Tokyo", "Osaka", "Chiba"]
+
+# LOCALE and COUNTRY_CODE are used for geo targeting.
+# LOCALE is using ISO 639-1 format. If an invalid LOCALE is given,
+# 'es' is used by default.
+LOCALE = "ja"
+
+# A list of country codes can be referenced here:
+# https://developers.google.com/google-ads/api/reference/data/geotargets
+COUNTRY_CODE = "JP"
+
+# Geo target constants practically never change, so suggestions are cached
+# on disk, keyed by locale, country code and location name.
+GEO_TARGET_CACHE_PATH = os.getenv(
+    "GEO_TARGET_CACHE_PATH",
+    os.path.join(os.getenv("CACHE_DIR", ".cache"), "geo_targets.json"),
+)
+_geo_target_cache = None
+_geo_target_cache_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the shared GoogleAdsClient, loading it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google.ads.googleads.client import GoogleAdsClient
+
+                _client = GoogleAdsClient.load_from_storage(version=API_VERSION)
+    return _client
+
+
+def get_service(client, name):
+    """Returns the service client `name` for `client`, creating it (and its
+    gRPC channel) only once."""
+    with _services_lock:
+        services = _services.setdefault(client, {})
+        if name not in services:
+            services[name] = client.get_service(name)
+        return services[name]
+
+
+def generate_campaign(ib_id=1234511267, cost=500, headlines=None, descriptions=None, keywords=None, client=None, customer_id=CUSTOMER_ID, single_request=True, geo_locations=None):
+    if client is None:
+        client = get_client()
 
     if keywords is None:
         keywords = ["Apples", "Oranges"]
@@ -39,6 +94,19 @@ def generate_campaign(ib_id=1234511267, cost=500, headlines=None, descriptions=N
     if headlines is None:
         headlines = ["Great", "Incredible", "Amazing"]
 
+    if single_request:
+        # Create everything atomically in one GoogleAdsService.Mutate call.
+        return create_complete_campaign(
+            client,
+            customer_id,
+            cost,
+            ib_id,
+            headlines,
+            descriptions,
+            keywords,
+            geo_locations,
+        )
+
     # Create a budget, which can be shared by multiple campaigns.
     campaign_budget = create_campaign_budget(client, customer_id, cost, ib_id)
 
@@ -56,7 +124,7 @@ def generate_campaign(ib_id=1234511267, cost=500, headlines=None, descriptions=N
 
     add_keywords(client, customer_id, ad_group_resource_name, keywords)
 
-    add_geo_targeting(client, customer_id, campaign_resource_name)
+    add_geo_targeting(client, customer_id, campaign_resource_name, geo_locations)
 
 
 def create_ad_text_asset(client, text, pinned_field=None):
@@ -77,20 +145,17 @@ def create_ad_text_asset(client, text, pinned_field=None):
     return ad_text_asset
 
 
-def create_campaign_budget(client, customer_id, cost, ib_id):
-    """Creates campaign budget resource.
+def build_campaign_budget_operation(client, cost, ib_id):
+    """Builds the operation that creates a campaign budget.
 
     Args:
       client: an initialized GoogleAdsClient instance.
-      customer_id: a client customer ID.
       cost: cost in yen
       ib_id: instabase id of venue
 
     Returns:
-      Campaign budget resource name.
+      A CampaignBudgetOperation.
     """
-    # Create a budget, which can be shared by multiple campaigns.
-    campaign_budget_service = client.get_service("CampaignBudgetService")
     campaign_budget_operation = client.get_type("CampaignBudgetOperation")
     campaign_budget = campaign_budget_operation.create
     campaign_budget.name = f"Campaign budget for {str(ib_id)}-{uuid.uuid4()}"
@@ -98,6 +163,26 @@ def create_campaign_budget(client, customer_id, cost, ib_id):
         client.enums.BudgetDeliveryMethodEnum.STANDARD
     )
     campaign_budget.amount_micros = cost * 1000000
+    return campaign_budget_operation
+
+
+def create_campaign_budget(client, customer_id, cost, ib_id):
+    """Creates campaign budget resource.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      cost: cost in yen
+      ib_id: instabase id of venue
+
+    Returns:
+      Campaign budget resource name.
+    """
+    # Create a budget, which can be shared by multiple campaigns.
+    campaign_budget_service = get_service(client, "CampaignBudgetService")
+    campaign_budget_operation = build_campaign_budget_operation(
+        client, cost, ib_id
+    )
 
     # Add budget.
     campaign_budget_response = campaign_budget_service.mutate_campaign_budgets(
@@ -107,19 +192,17 @@ def create_campaign_budget(client, customer_id, cost, ib_id):
     return campaign_budget_response.results[0].resource_name
 
 
-def create_campaign(client, customer_id, campaign_budget, ib_id):
-    """Creates campaign resource.
+def build_campaign_operation(client, campaign_budget, ib_id):
+    """Builds the operation that creates a campaign.
 
     Args:
       client: an initialized GoogleAdsClient instance.
-      customer_id: a client customer ID.
       campaign_budget: a budget resource name.
       ib_id: instabase venue id
 
     Returns:
-      Campaign resource name.
+      A CampaignOperation.
     """
-    campaign_service = client.get_service("CampaignService")
     campaign_operation = client.get_type("CampaignOperation")
     campaign = campaign_operation.create
     campaign.name = f"Campaign for {str(ib_id)}-{uuid.uuid4()}"
@@ -156,6 +239,26 @@ def create_campaign(client, customer_id, campaign_budget, ib_id):
     # end_time = start_time + datetime.timedelta(weeks=4)
     # campaign.end_date = datetime.date.strftime(end_time, _DATE_FORMAT)
 
+    return campaign_operation
+
+
+def create_campaign(client, customer_id, campaign_budget, ib_id):
+    """Creates campaign resource.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      campaign_budget: a budget resource name.
+      ib_id: instabase venue id
+
+    Returns:
+      Campaign resource name.
+    """
+    campaign_service = get_service(client, "CampaignService")
+    campaign_operation = build_campaign_operation(
+        client, campaign_budget, ib_id
+    )
+
     # Add the campaign.
     campaign_response = campaign_service.mutate_campaigns(
         customer_id=customer_id, operations=[campaign_operation]
@@ -165,20 +268,17 @@ def create_campaign(client, customer_id, campaign_budget, ib_id):
     return resource_name
 
 
-def create_ad_group(client, customer_id, campaign_resource_name, ib_id):
-    """Creates ad group.
+def build_ad_group_operation(client, campaign_resource_name, ib_id):
+    """Builds the operation that creates an ad group.
 
     Args:
       client: an initialized GoogleAdsClient instance.
-      customer_id: a client customer ID.
       campaign_resource_name: a campaign resource name.
       ib_id: instabase venue id
 
     Returns:
-      Ad group ID.
+      An AdGroupOperation.
     """
-    ad_group_service = client.get_service("AdGroupService")
-
     ad_group_operation = client.get_type("AdGroupOperation")
     ad_group = ad_group_operation.create
     ad_group.name = f"Adgroup for {str(ib_id)}-{uuid.uuid4()}"
@@ -189,6 +289,27 @@ def create_ad_group(client, customer_id, campaign_resource_name, ib_id):
     # If you want to set up a max CPC bid uncomment line below.
     # ad_group.cpc_bid_micros = 10000000
 
+    return ad_group_operation
+
+
+def create_ad_group(client, customer_id, campaign_resource_name, ib_id):
+    """Creates ad group.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      campaign_resource_name: a campaign resource name.
+      ib_id: instabase venue id
+
+    Returns:
+      Ad group ID.
+    """
+    ad_group_service = get_service(client, "AdGroupService")
+
+    ad_group_operation = build_ad_group_operation(
+        client, campaign_resource_name, ib_id
+    )
+
     # Add the ad group.
     ad_group_response = ad_group_service.mutate_ad_groups(
         customer_id=customer_id, operations=[ad_group_operation]
@@ -198,24 +319,21 @@ def create_ad_group(client, customer_id, campaign_resource_name, ib_id):
     return ad_group_resource_name
 
 
-def create_ad_group_ad(
-        client, customer_id, ad_group_resource_name, ib_id, headlines, descriptions
+def build_ad_group_ad_operation(
+        client, ad_group_resource_name, ib_id, headlines, descriptions
 ):
-    """Creates ad group ad.
+    """Builds the operation that creates a responsive search ad.
 
     Args:
       client: an initialized GoogleAdsClient instance.
-      customer_id: a client customer ID.
       ad_group_resource_name: an ad group resource name.
       ib_id: instabase venue id
       headlines: a list of 3 headlines for ad listing
       descriptions: a list of 2 descriptions for ad listing
 
     Returns:
-      Ad group ad resource name.
+      An AdGroupAdOperation.
     """
-    ad_group_ad_service = client.get_service("AdGroupAdService")
-
     ad_group_ad_operation = client.get_type("AdGroupAdOperation")
     ad_group_ad = ad_group_ad_operation.create
     ad_group_ad.status = client.enums.AdGroupAdStatusEnum.ENABLED
@@ -254,6 +372,31 @@ def create_ad_group_ad(
         [description_1, description_2]
     )
 
+    return ad_group_ad_operation
+
+
+def create_ad_group_ad(
+        client, customer_id, ad_group_resource_name, ib_id, headlines, descriptions
+):
+    """Creates ad group ad.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      ad_group_resource_name: an ad group resource name.
+      ib_id: instabase venue id
+      headlines: a list of 3 headlines for ad listing
+      descriptions: a list of 2 descriptions for ad listing
+
+    Returns:
+      Ad group ad resource name.
+    """
+    ad_group_ad_service = get_service(client, "AdGroupAdService")
+
+    ad_group_ad_operation = build_ad_group_ad_operation(
+        client, ad_group_resource_name, ib_id, headlines, descriptions
+    )
+
     # Send a request to the server to add a responsive search ad.
     ad_group_ad_response = ad_group_ad_service.mutate_ad_group_ads(
         customer_id=customer_id, operations=[ad_group_ad_operation]
@@ -266,24 +409,17 @@ def create_ad_group_ad(
         )
 
 
-def add_keywords(client, customer_id, ad_group_resource_name, broad_matches):
-    """Creates keywords.
-
-    Creates 3 keyword match types: EXACT, PHRASE, and BROAD.
-
-    EXACT: ads may show on searches that ARE the same meaning as your keyword.
-    PHRASE: ads may show on searches that INCLUDE the meaning of your keyword.
-    BROAD: ads may show on searches that RELATE to your keyword.
-    For smart bidding, BROAD is the recommended one.
+def build_keyword_operations(client, ad_group_resource_name, broad_matches):
+    """Builds the operations that create broad match keywords.
 
     Args:
       client: an initialized GoogleAdsClient instance.
-      customer_id: a client customer ID.
       ad_group_resource_name: an ad group resource name.
       broad_matches: a list of terms to match broadly
-    """
-    ad_group_criterion_service = client.get_service("AdGroupCriterionService")
 
+    Returns:
+      A list of AdGroupCriterionOperations.
+    """
     operations = []
 
     # Create keywords.
@@ -299,6 +435,31 @@ def add_keywords(client, customer_id, ad_group_resource_name, broad_matches):
 
         operations.append(ad_group_criterion_operation)
 
+    return operations
+
+
+def add_keywords(client, customer_id, ad_group_resource_name, broad_matches):
+    """Creates keywords.
+
+    Creates 3 keyword match types: EXACT, PHRASE, and BROAD.
+
+    EXACT: ads may show on searches that ARE the same meaning as your keyword.
+    PHRASE: ads may show on searches that INCLUDE the meaning of your keyword.
+    BROAD: ads may show on searches that RELATE to your keyword.
+    For smart bidding, BROAD is the recommended one.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      ad_group_resource_name: an ad group resource name.
+      broad_matches: a list of terms to match broadly
+    """
+    ad_group_criterion_service = get_service(client, "AdGroupCriterionService")
+
+    operations = build_keyword_operations(
+        client, ad_group_resource_name, broad_matches
+    )
+
     # Add keywords
     ad_group_criterion_response = (
         ad_group_criterion_service.mutate_ad_group_criteria(
@@ -310,70 +471,175 @@ def add_keywords(client, customer_id, ad_group_resource_name, broad_matches):
         print("Created keyword " f"{result.resource_name}.")
 
 
-def add_geo_targeting(client, customer_id, campaign_resource_name):
-    """Creates geo targets.
+def _geo_target_cache_key(locale, country_code, location_name):
+    return f"{locale}|{country_code}|{location_name}"
 
-    Args:
-      client: an initialized GoogleAdsClient instance.
-      customer_id: a client customer ID.
-      campaign_resource_name: an campaign resource name.
 
-    Returns:
-      Geo targets.
-    """
-    # Geo targeting from user.
-    GEO_LOCATION_1 = "Tokyo"
-    GEO_LOCATION_2 = "Osaka"
-    GEO_LOCATION_3 = "Chiba"
+def _load_geo_target_cache():
+    global _geo_target_cache
+    if _geo_target_cache is None:
+        try:
+            with open(GEO_TARGET_CACHE_PATH) as f:
+                _geo_target_cache = json.load(f)
+        except (OSError, ValueError):
+            _geo_target_cache = {}
+    return _geo_target_cache
 
-    # LOCALE and COUNTRY_CODE are used for geo targeting.
-    # LOCALE is using ISO 639-1 format. If an invalid LOCALE is given,
-    # 'es' is used by default.
-    LOCALE = "ja"
 
-    # A list of country codes can be referenced here:
-    # https://developers.google.com/google-ads/api/reference/data/geotargets
-    COUNTRY_CODE = "JP"
+def _save_geo_target_cache(cache):
+    directory = os.path.dirname(GEO_TARGET_CACHE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = GEO_TARGET_CACHE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, GEO_TARGET_CACHE_PATH)
 
-    geo_target_constant_service = client.get_service("GeoTargetConstantService")
 
-    # Search by location names from
-    # GeoTargetConstantService.suggest_geo_target_constants() and directly
-    # apply GeoTargetConstant.resource_name.
-    gtc_request = client.get_type("SuggestGeoTargetConstantsRequest")
-    gtc_request.locale = LOCALE
-    gtc_request.country_code = COUNTRY_CODE
+def get_geo_target_constants(
+        client, location_names=None, locale=LOCALE, country_code=COUNTRY_CODE
+):
+    """Looks up the geo target constants for the given locations.
 
-    # The location names to get suggested geo target constants.
-    gtc_request.location_names.names.extend(
-        [GEO_LOCATION_1, GEO_LOCATION_2, GEO_LOCATION_3]
-    )
+    Only locations missing from the local cache are sent to
+    GeoTargetConstantService.suggest_geo_target_constants().
 
-    results = geo_target_constant_service.suggest_geo_target_constants(
-        gtc_request
-    )
+    Args:
+      client: an initialized GoogleAdsClient instance, or None to load the
+        shared client only if some locations are missing from the cache.
+      location_names: a list of location names, GEO_LOCATIONS by default.
+      locale: the locale of the location names.
+      country_code: the country to search in.
+
+    Returns:
+      A list of geo target constant resource names.
+    """
+    if location_names is None:
+        location_names = GEO_LOCATIONS
+
+    with _geo_target_cache_lock:
+        cache = _load_geo_target_cache()
+        missing = [
+            name for name in location_names
+            if _geo_target_cache_key(locale, country_code, name) not in cache
+        ]
+        if missing:
+            if client is None:
+                client = get_client()
+            geo_target_constant_service = get_service(
+                client, "GeoTargetConstantService"
+            )
+
+            # Search by location names from
+            # GeoTargetConstantService.suggest_geo_target_constants() and
+            # directly apply GeoTargetConstant.resource_name.
+            gtc_request = client.get_type("SuggestGeoTargetConstantsRequest")
+            gtc_request.locale = locale
+            gtc_request.country_code = country_code
+
+            # The location names to get suggested geo target constants.
+            gtc_request.location_names.names.extend(missing)
+
+            results = geo_target_constant_service.suggest_geo_target_constants(
+                gtc_request
+            )
+
+            suggestions = {name: [] for name in missing}
+            for suggestion in results.geo_target_constant_suggestions:
+                print(
+                    "geo_target_constant: "
+                    f"{suggestion.geo_target_constant.resource_name} "
+                    f"is found in LOCALE ({suggestion.locale}) "
+                    f"with reach ({suggestion.reach}) "
+                    f"from search term ({suggestion.search_term})."
+                )
+                suggestions.setdefault(suggestion.search_term, []).append(
+                    suggestion.geo_target_constant.resource_name
+                )
+            for name, resource_names in suggestions.items():
+                # Names without suggestions are looked up again next time
+                # rather than cached as resolving to nothing
+                if resource_names:
+                    cache[_geo_target_cache_key(locale, country_code, name)] = (
+                        resource_names
+                    )
+            _save_geo_target_cache(cache)
+
+        geo_target_constants = []
+        for name in location_names:
+            resource_names = cache.get(
+                _geo_target_cache_key(locale, country_code, name), []
+            )
+            if not resource_names:
+                print(
+                    f'Location "{name}" did not resolve to any geo target '
+                    "constant and will not be targeted."
+                )
+            for resource_name in resource_names:
+                if resource_name not in geo_target_constants:
+                    geo_target_constants.append(resource_name)
+
+    return geo_target_constants
+
+
+def warm_geo_target_cache(client=None, location_names=None):
+    """Resolves the default geo targets ahead of time, e.g. at startup, so
+    that campaign creation does not wait for the lookup. The Google Ads
+    client is only loaded if some locations are not cached yet."""
+    try:
+        get_geo_target_constants(client, location_names)
+    except Exception as e:
+        print(f"Could not warm the geo target cache: {e}")
+
+
+def build_geo_target_operations(
+        client, campaign_resource_name, geo_target_constants
+):
+    """Builds the operations that create location criteria.
 
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      campaign_resource_name: an campaign resource name.
+      geo_target_constants: a list of geo target constant resource names.
+
+    Returns:
+      A list of CampaignCriterionOperations.
+    """
     operations = []
-    for suggestion in results.geo_target_constant_suggestions:
-        print(
-            "geo_target_constant: "
-            f"{suggestion.geo_target_constant.resource_name} "
-            f"is found in LOCALE ({suggestion.locale}) "
-            f"with reach ({suggestion.reach}) "
-            f"from search term ({suggestion.search_term})."
-        )
+    for geo_target_constant in geo_target_constants:
         # Create the campaign criterion for location targeting.
         campaign_criterion_operation = client.get_type(
             "CampaignCriterionOperation"
         )
         campaign_criterion = campaign_criterion_operation.create
         campaign_criterion.campaign = campaign_resource_name
-        campaign_criterion.location.geo_target_constant = (
-            suggestion.geo_target_constant.resource_name
-        )
+        campaign_criterion.location.geo_target_constant = geo_target_constant
         operations.append(campaign_criterion_operation)
 
-    campaign_criterion_service = client.get_service("CampaignCriterionService")
+    return operations
+
+
+def add_geo_targeting(
+        client, customer_id, campaign_resource_name, location_names=None
+):
+    """Creates geo targets.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      campaign_resource_name: an campaign resource name.
+      location_names: a list of location names, GEO_LOCATIONS by default.
+
+    Returns:
+      Geo targets.
+    """
+    operations = build_geo_target_operations(
+        client,
+        campaign_resource_name,
+        get_geo_target_constants(client, location_names),
+    )
+
+    campaign_criterion_service = get_service(client, "CampaignCriterionService")
     campaign_criterion_response = (
         campaign_criterion_service.mutate_campaign_criteria(
             customer_id=customer_id, operations=[*operations]
@@ -382,3 +648,256 @@ def add_geo_targeting(client, customer_id, campaign_resource_name):
 
     for result in campaign_criterion_response.results:
         print(f'Added campaign criterion "{result.resource_name}".')
+
+
+def build_complete_campaign_operations(
+        client,
+        customer_id,
+        cost,
+        ib_id,
+        headlines,
+        descriptions,
+        keywords,
+        geo_target_constants,
+        temporary_id=-1,
+):
+    """Builds the operations that create a complete campaign in one request.
+
+    The budget, campaign and ad group reference each other through temporary
+    resource names with negative IDs, which the API resolves within the
+    request. `temporary_id` to `temporary_id - 2` are used.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      cost: cost in yen
+      ib_id: instabase venue id
+      headlines: a list of 3 headlines for ad listing
+      descriptions: a list of 2 descriptions for ad listing
+      keywords: a list of terms to match broadly
+      geo_target_constants: a list of geo target constant resource names.
+      temporary_id: the first (negative) temporary ID to use.
+
+    Returns:
+      A list of MutateOperations, in dependency order.
+    """
+    googleads_service = get_service(client, "GoogleAdsService")
+    campaign_budget_resource_name = googleads_service.campaign_budget_path(
+        customer_id, temporary_id
+    )
+    campaign_resource_name = googleads_service.campaign_path(
+        customer_id, temporary_id - 1
+    )
+    ad_group_resource_name = googleads_service.ad_group_path(
+        customer_id, temporary_id - 2
+    )
+
+    campaign_budget_operation = build_campaign_budget_operation(
+        client, cost, ib_id
+    )
+    campaign_budget_operation.create.resource_name = (
+        campaign_budget_resource_name
+    )
+    campaign_operation = build_campaign_operation(
+        client, campaign_budget_resource_name, ib_id
+    )
+    campaign_operation.create.resource_name = campaign_resource_name
+    ad_group_operation = build_ad_group_operation(
+        client, campaign_resource_name, ib_id
+    )
+    ad_group_operation.create.resource_name = ad_group_resource_name
+
+    operations = [
+        ("campaign_budget_operation", campaign_budget_operation),
+        ("campaign_operation", campaign_operation),
+        ("ad_group_operation", ad_group_operation),
+        (
+            "ad_group_ad_operation",
+            build_ad_group_ad_operation(
+                client, ad_group_resource_name, ib_id, headlines, descriptions
+            ),
+        ),
+    ]
+    operations.extend(
+        ("ad_group_criterion_operation", operation)
+        for operation in build_keyword_operations(
+            client, ad_group_resource_name, keywords
+        )
+    )
+    operations.extend(
+        ("campaign_criterion_operation", operation)
+        for operation in build_geo_target_operations(
+            client, campaign_resource_name, geo_target_constants
+        )
+    )
+
+    mutate_operations = []
+    for field, operation in operations:
+        mutate_operation = client.get_type("MutateOperation")
+        client.copy_from(getattr(mutate_operation, field), operation)
+        mutate_operations.append(mutate_operation)
+    return mutate_operations
+
+
+def created_resource_names(mutate_operation_responses):
+    """Returns the resource names in a list of MutateOperationResponses."""
+    resource_names = []
+    for response in mutate_operation_responses:
+        pb = getattr(response, "_pb", response)
+        field = pb.WhichOneof("response")
+        resource_names.append(getattr(pb, field).resource_name)
+    return resource_names
+
+
+def create_complete_campaign(
+        client,
+        customer_id,
+        cost,
+        ib_id,
+        headlines,
+        descriptions,
+        keywords,
+        geo_locations=None,
+):
+    """Creates a budget, campaign, ad group, ad, keywords and geo targets
+    with a single atomic GoogleAdsService.Mutate request.
+
+    Args:
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      cost: cost in yen
+      ib_id: instabase venue id
+      headlines: a list of 3 headlines for ad listing
+      descriptions: a list of 2 descriptions for ad listing
+      keywords: a list of terms to match broadly
+      geo_locations: a list of location names, GEO_LOCATIONS by default.
+
+    Returns:
+      The resource names of the created resources.
+    """
+    googleads_service = get_service(client, "GoogleAdsService")
+    mutate_operations = build_complete_campaign_operations(
+        client,
+        customer_id,
+        cost,
+        ib_id,
+        headlines,
+        descriptions,
+        keywords,
+        get_geo_target_constants(client, geo_locations),
+    )
+
+    # Either every resource is created or, on failure, none is.
+    response = googleads_service.mutate(
+        customer_id=customer_id, mutate_operations=mutate_operations
+    )
+
+    resource_names = created_resource_names(
+        response.mutate_operation_responses
+    )
+    for resource_name in resource_names:
+        print(f"Created {resource_name}.")
+    return resource_names
+
+
+def generate_campaigns_bulk(
+        venue_specs,
+        client=None,
+        customer_id=CUSTOMER_ID,
+        chunk_size=1000,
+        timeout=3600,
+):
+    """Creates complete campaigns for many venues with one BatchJob.
+
+    The operations of all venues are uploaded to a single batch job, so the
+    number of API requests grows with the number of operations (in chunks of
+    `chunk_size`) rather than with the number of venues.
+
+    Args:
+      venue_specs: a list of dicts with the keys `ib_id`, `cost`,
+        `headlines`, `descriptions`, `keywords` and optionally
+        `geo_locations`, as for generate_campaign.
+      client: an initialized GoogleAdsClient instance.
+      customer_id: a client customer ID.
+      chunk_size: the maximum number of operations per upload request.
+      timeout: seconds to wait for the batch job to finish.
+
+    Returns:
+      A list with one dict per venue spec, in the same order, holding the
+      `ib_id`, the `resource_names` that were created and any `errors`.
+    """
+    if client is None:
+        client = get_client()
+    batch_job_service = get_service(client, "BatchJobService")
+
+    # Every venue gets its own range of temporary IDs, since temporary IDs
+    # must be unique within the whole batch job.
+    mutate_operations = []
+    venue_indexes = []
+    for i, spec in enumerate(venue_specs):
+        operations = build_complete_campaign_operations(
+            client,
+            customer_id,
+            spec["cost"],
+            spec["ib_id"],
+            spec["headlines"],
+            spec["descriptions"],
+            spec["keywords"],
+            get_geo_target_constants(client, spec.get("geo_locations")),
+            temporary_id=-1 - 3 * i,
+        )
+        mutate_operations.extend(operations)
+        venue_indexes.extend([i] * len(operations))
+
+    batch_job_operation = client.get_type("BatchJobOperation")
+    client.copy_from(batch_job_operation.create, client.get_type("BatchJob"))
+    batch_job_resource_name = batch_job_service.mutate_batch_job(
+        customer_id=customer_id, operation=batch_job_operation
+    ).result.resource_name
+    print(f"Created batch job {batch_job_resource_name}.")
+
+    sequence_token = None
+    for start in range(0, len(mutate_operations), chunk_size):
+        response = batch_job_service.add_batch_job_operations(
+            resource_name=batch_job_resource_name,
+            sequence_token=sequence_token,
+            mutate_operations=mutate_operations[start:start + chunk_size],
+        )
+        sequence_token = response.next_sequence_token
+    print(
+        f"Added {len(mutate_operations)} operations for "
+        f"{len(venue_specs)} venues to the batch job."
+    )
+
+    # Polls the long-running operation until the job has finished.
+    batch_job_service.run_batch_job(
+        resource_name=batch_job_resource_name
+    ).result(timeout=timeout)
+
+    results = [
+        {"ib_id": spec["ib_id"], "resource_names": [], "errors": []}
+        for spec in venue_specs
+    ]
+    list_results_request = client.get_type("ListBatchJobResultsRequest")
+    list_results_request.resource_name = batch_job_resource_name
+    list_results_request.page_size = chunk_size
+    for batch_job_result in batch_job_service.list_batch_job_results(
+            request=list_results_request
+    ):
+        result = results[venue_indexes[batch_job_result.operation_index]]
+        if batch_job_result.status.message:
+            result["errors"].append(batch_job_result.status.message)
+        else:
+            result["resource_names"].extend(
+                created_resource_names(
+                    [batch_job_result.mutate_operation_response]
+                )
+            )
+
+    for result in results:
+        print(
+            f"Venue {result['ib_id']}: created "
+            f"{len(result['resource_names'])} resources with "
+            f"{len(result['errors'])} errors."
+        )
+    return results
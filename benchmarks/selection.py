@@ -0,0 +1,93 @@
+"""
+Benchmark of the `select_best_image` modes.
+
+Runs the selection for one venue photo and its candidate edits in both
+`per_image` and `contact_sheet` mode and reports, per mode, the median
+latency and the token usage of the GPT-4V call, and which edit was picked.
+Calls the OpenAI API (with the response cache bypassed), so OPENAI_API_KEY
+must be set.
+
+Run from the repository root:
+
+    $ python benchmarks/selection.py original.jpeg edited_1.jpeg \
+        edited_2.jpeg --trend "Home Party" --runs 3
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from event_loop import run  # noqa: E402
+from images import ImageHandle  # noqa: E402
+
+MODES = ["per_image", "contact_sheet"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("original", help="Original venue photo")
+    parser.add_argument("edits", nargs="+", help="Candidate edited photos")
+    parser.add_argument("--trend", default="Home Party")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    def load(path):
+        with open(path, "rb") as f:
+            return ImageHandle(f.read())
+
+    original_image = load(args.original)
+    edited_dict = {path: load(path) for path in args.edits}
+
+    # Record the usage of every completion made during a selection
+    usages = []
+    chat_completion = app.chat_completion
+
+    async def recording_chat_completion(**kwargs):
+        response = await chat_completion(**kwargs)
+        usages.append((kwargs["model"], response.usage))
+        return response
+
+    app.chat_completion = recording_chat_completion
+
+    results = {mode: [] for mode in MODES}
+    for _ in range(args.runs):
+        for mode in MODES:
+            usages.clear()
+            started_at = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                best = run(
+                    app.select_best_image(original_image,
+                                          edited_dict,
+                                          args.trend,
+                                          use_cache=False,
+                                          mode=mode))
+            elapsed = time.perf_counter() - started_at
+            vision = [
+                usage for model, usage in usages if "vision" in model
+            ][0]
+            picked = next(path for path, image in edited_dict.items()
+                          if image is best)
+            results[mode].append((elapsed, vision, picked))
+
+    print(f"{len(edited_dict)} candidates, median over {args.runs} runs")
+    for mode in MODES:
+        runs = results[mode]
+        print(f"{mode}:")
+        print(f"  latency:           "
+              f"{statistics.median(r[0] for r in runs):8.2f} s")
+        print(f"  prompt tokens:     "
+              f"{statistics.median(r[1].prompt_tokens for r in runs):8.0f}")
+        print(f"  completion tokens: "
+              f"{statistics.median(r[1].completion_tokens for r in runs):8.0f}")
+        print(f"  picked:            {', '.join(r[2] for r in runs)}")
+
+
+if __name__ == "__main__":
+    main()
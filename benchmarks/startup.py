@@ -0,0 +1,136 @@
+"""
+Startup benchmark for the backend.
+
+Measures, over several cold starts of a fresh interpreter:
+- the time to `import app`, broken down by the modules it imports directly
+  (from `python -X importtime`)
+- the time from process start until `GET /ready` is first served
+- the time `GET /ready?warm=1` takes to import the lazily loaded dependencies
+
+Run from the repository root:
+
+    $ python benchmarks/startup.py --runs 5
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_breakdown():
+    """Returns the total `import app` time and the cumulative time of each
+    module it imports directly, in seconds."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=ROOT,
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    # Nested imports are listed before their parent, indented by two more
+    # spaces per level
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            cumulative = int(cumulative) / 1e6
+        except ValueError:
+            continue  # Header line
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == "app":
+                return cumulative, modules
+            # Imported during interpreter startup
+            modules = {}
+        elif depth == 1:
+            modules[name.strip()] = cumulative
+    raise RuntimeError("app was not imported")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url, timeout=60):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def time_to_first_request(timeout=60):
+    """Starts the app in a fresh process and returns the seconds until
+    `/ready` is served, and the seconds `/ready?warm=1` then takes."""
+    port = free_port()
+    started_at = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable, "-c",
+            f"import app; app.app.run(host='127.0.0.1', port={port})"
+        ],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                get(f"http://127.0.0.1:{port}/ready", timeout=1)
+                break
+            except urllib.error.HTTPError:
+                # Served, e.g. a 404 from a build without the endpoint
+                break
+            except OSError:
+                if time.perf_counter() - started_at > timeout:
+                    raise TimeoutError("The app did not start in time")
+                time.sleep(0.01)
+        first_request = time.perf_counter() - started_at
+
+        warm_started_at = time.perf_counter()
+        try:
+            get(f"http://127.0.0.1:{port}/ready?warm=1")
+        except urllib.error.HTTPError:
+            pass
+        warm = time.perf_counter() - warm_started_at
+    finally:
+        server.terminate()
+        server.wait()
+    return first_request, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    totals = []
+    modules = {}
+    first_requests = []
+    warms = []
+    for _ in range(args.runs):
+        total, breakdown = import_breakdown()
+        totals.append(total)
+        for name, seconds in breakdown.items():
+            modules.setdefault(name, []).append(seconds)
+        first_request, warm = time_to_first_request()
+        first_requests.append(first_request)
+        warms.append(warm)
+
+    print(f"Median over {args.runs} runs")
+    print(f"import app: {statistics.median(totals) * 1000:8.1f} ms")
+    for name, seconds in sorted(modules.items(),
+                                key=lambda item: -statistics.median(item[1])):
+        print(f"  {name:<30} {statistics.median(seconds) * 1000:8.1f} ms")
+    print(f"time to first /ready: {statistics.median(first_requests) * 1000:8.1f} ms")
+    print(f"/ready?warm=1: {statistics.median(warms) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
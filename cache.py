@@ -0,0 +1,226 @@
+"""
+In-process caches shared by the backend.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries go stale after `ttl` seconds.
+
+    Stale entries are kept around until they are evicted so that callers can
+    revalidate them (e.g. with a conditional HTTP request) instead of
+    rebuilding them from scratch.
+    """
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "evictions": 0,
+        }
+
+    def lookup(self, key, max_age=None):
+        """Looks up a key.
+
+        Returns:
+          A `(value, fresh)` tuple. `value` is None if the key is not cached,
+          and `fresh` is False if the entry is older than `max_age` seconds
+          (the TTL by default).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None, False
+            self._entries.move_to_end(key)
+            stored_at, value = entry
+            if time.monotonic() - stored_at <= (self.ttl if max_age is None
+                                                else max_age):
+                self._counters["hits"] += 1
+                return value, True
+            self._counters["stale"] += 1
+            return value, False
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def age(self, key):
+        """Returns the seconds since `key` was stored, or None if it is not
+        cached. Does not count as a lookup."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[0]
+
+    def record(self, counter, amount=1):
+        """Increments a caller-defined counter, e.g. `revalidated`."""
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+            }
+
+
+def content_key(*parts):
+    """Returns a SHA-256 hex digest over `parts` (bytes or str)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+# Keys as returned by `content_key`
+_content_key_pattern = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobCache:
+    """Two-tier (memory + disk) cache of bytes values keyed by content hash.
+
+    Both tiers are bounded by total size in bytes and evict least recently
+    used entries first. The disk tier survives restarts and can be shared by
+    several processes: recency is the files' mtime, and the size bound is
+    enforced over the whole directory by rescanning it after each write. It is
+    skipped when `directory` is None.
+    """
+
+    def __init__(self,
+                 directory=None,
+                 max_memory_bytes=64 * 1024 * 1024,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # Sizes of the files on disk as of the last scan
+        self._disk = {}
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan_disk()
+
+    def _scan_disk(self):
+        """Reloads the sizes of the files on disk, including those written by
+        other processes, and evicts the least recently used ones while they
+        exceed `max_disk_bytes`."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(self._path(name))
+            except OSError:
+                # Evicted by another process in the meantime
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        entries.sort()
+        total = sum(size for _, _, size in entries)
+        while entries and total > self.max_disk_bytes:
+            _, evicted, size = entries.pop(0)
+            total -= size
+            self._counters["evictions"] += 1
+            try:
+                os.remove(self._path(evicted))
+            except OSError:
+                pass
+        self._disk = {name: size for _, name, size in entries}
+        self._disk_bytes = total
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _remember(self, key, value):
+        if len(value) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._counters["evictions"] += 1
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return value
+            if (self.directory is None
+                    or not _content_key_pattern.fullmatch(key)):
+                self._counters["misses"] += 1
+                return None
+            # Other processes sharing the directory may have written the key
+            # since the last scan, so the file is checked even if the key is
+            # not indexed
+            try:
+                with open(self._path(key), "rb") as f:
+                    value = f.read()
+                os.utime(self._path(key))
+            except OSError:
+                self._disk_bytes -= self._disk.pop(key, 0)
+                self._counters["misses"] += 1
+                return None
+            self._disk_bytes += len(value) - self._disk.get(key, 0)
+            self._disk[key] = len(value)
+            self._counters["disk_hits"] += 1
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            if self.directory is None or len(value) > self.max_disk_bytes:
+                return
+            # Per-process temporary name, as another process may be writing
+            # the same key
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+            self._scan_disk()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
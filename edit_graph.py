@@ -0,0 +1,71 @@
+"""
+Dependency-graph scheduling of the search-and-replace edits in `/edit`.
+
+An edit plan is a list of `EditNode`s. Each node applies prompt number
+`prompt_index` to the output of its `parent` node (or to the original image
+when `parent` is None). Every edit starts as soon as its own input is ready,
+so a slow edit only delays the edits that build on it.
+"""
+
+import asyncio
+from collections import namedtuple
+
+EditNode = namedtuple("EditNode", ["key", "parent", "prompt_index"])
+
+
+def chained_edit_plan(num_prompts, rounds=2, offset=1):
+    """Builds the plan for `rounds` rounds of chained edits.
+
+    The first round applies every prompt to the original image. Each later
+    round applies prompt `(i + offset) % num_prompts` to every edit of the
+    previous round whose last prompt was `i`. With the defaults this gives
+    the edits `0, 1, 2, 0->1, 1->2, 2->0` for three prompts.
+    """
+    plan = [EditNode(f'{i}', None, i) for i in range(num_prompts)]
+    previous = plan
+    for _ in range(rounds - 1):
+        current = []
+        for parent in previous:
+            prompt_index = (parent.prompt_index + offset) % num_prompts
+            current.append(
+                EditNode(f'{parent.key}->{prompt_index}', parent.key,
+                         prompt_index))
+        plan.extend(current)
+        previous = current
+    return plan
+
+
+async def run_edit_plan(plan, original_image, edit, on_result=None):
+    """Runs every node of `plan` as soon as its parent has finished.
+
+    Args:
+      plan: a list of EditNodes where parents come before their children.
+      original_image: the input of nodes without a parent.
+      edit: a coroutine function `edit(input_image, prompt_index)`.
+      on_result: an optional callback `on_result(key, image)` called as soon
+        as each edit finishes.
+
+    Returns:
+      A dict mapping node keys to edited images, in plan order.
+    """
+    tasks = {}
+
+    async def run_node(node):
+        if node.parent is None:
+            input_image = original_image
+        else:
+            input_image = await tasks[node.parent]
+        image = await edit(input_image, node.prompt_index)
+        if on_result is not None:
+            on_result(node.key, image)
+        return image
+
+    for node in plan:
+        tasks[node.key] = asyncio.ensure_future(run_node(node))
+    try:
+        results = await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return dict(zip(tasks.keys(), results))
@@ -0,0 +1,67 @@
+"""
+A persistent asyncio event loop shared by all requests.
+
+Flask serves each request on a worker thread. Instead of creating and tearing
+down a loop per request with `asyncio.run`, routes hand their coroutines to
+one long-lived loop running in a background thread. Connection pools, caches
+and semaphores bound to that loop therefore live across requests, and the
+I/O of concurrent requests overlaps on it.
+"""
+
+import asyncio
+import atexit
+import threading
+
+from http_clients import aclose_clients
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """Returns the shared loop, starting it on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever,
+                             name="event-loop",
+                             daemon=True).start()
+        return _loop
+
+
+def run(coro):
+    """Runs `coro` on the shared loop and blocks until it has finished.
+
+    Must not be called from the loop thread itself.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def iterate(agen):
+    """Iterates the async generator `agen` on the shared loop from
+    synchronous code, e.g. a streaming Flask response."""
+    loop = get_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(),
+                                                       loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+
+def shutdown():
+    """Closes the shared HTTP clients and stops the loop."""
+    global _loop
+    with _lock:
+        loop, _loop = _loop, None
+    if loop is None:
+        return
+    asyncio.run_coroutine_threadsafe(aclose_clients(), loop).result(timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,36 @@
+"""
+Shared, long-lived async HTTP clients.
+
+Clients are registered once by name with a factory and created lazily the
+first time they are used, so every call site talking to the same upstream
+reuses one keep-alive connection pool. httpx connections are bound to the
+event loop they were opened on, so one client is kept per (loop, name).
+"""
+
+import asyncio
+
+_factories = {}
+_clients = {}
+
+
+def register_client(name, factory):
+    """Registers a zero-argument factory returning an `httpx.AsyncClient`."""
+    _factories[name] = factory
+
+
+def get_client(name):
+    """Returns the shared client `name` for the running event loop."""
+    key = (asyncio.get_running_loop(), name)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        client = _factories[name]()
+        _clients[key] = client
+    return client
+
+
+async def aclose_clients():
+    """Closes all clients that belong to the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _clients if key[0] is loop]:
+        await _clients.pop(key).aclose()
+
@@ -0,0 +1,187 @@
+"""
+Images passed through the edit pipeline.
+
+An `ImageHandle` wraps the raw encoded bytes of an image. The digest, the
+base64 encoding and downscaled renditions are only computed when first needed
+and are then kept on the handle, so an image that goes through several stages
+of a request is encoded at most once each. Base64 is only produced at the API
+boundary.
+
+Downscaled renditions are decoded in JPEG draft mode (the decoder skips
+straight to a reduced scale), built on worker threads with
+`downscaled_async`, and cached by content digest across requests.
+
+`ImageStore` keeps images server-side by content digest, so that clients can
+refer to an image by id instead of uploading it again.
+"""
+
+import asyncio
+import base64
+import io
+import os
+
+from cache import BlobCache, TTLCache, content_key
+
+# Renditions by (digest, scale), shared by all handles
+rendition_cache = BlobCache(
+    max_memory_bytes=int(os.getenv("RENDITION_CACHE_MB", "32")) << 20)
+
+
+def guess_mime_type(data):
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    return "image/jpeg"
+
+
+class ImageHandle:
+
+    def __init__(self, data, mime_type=None):
+        self.data = data
+        self.mime_type = mime_type or guess_mime_type(data)
+        self._digest = None
+        self._base64 = None
+        self._renditions = {}
+
+    @classmethod
+    def from_base64(cls, value, mime_type=None):
+        return cls(base64.b64decode(value), mime_type)
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = content_key(self.data)
+        return self._digest
+
+    def base64(self):
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.base64()}"
+
+    def downscaled(self, scale_factor):
+        """Returns a JPEG rendition scaled by `scale_factor`."""
+        rendition = self._renditions.get(scale_factor)
+        if rendition is None:
+            key = content_key(self.digest, repr(scale_factor))
+            data = rendition_cache.get(key)
+            if data is None:
+                data = downscale_jpeg(self.data, scale_factor)
+                rendition_cache.put(key, data)
+            rendition = ImageHandle(data, "image/jpeg")
+            self._renditions[scale_factor] = rendition
+        return rendition
+
+    async def downscaled_async(self, scale_factor):
+        """Same as `downscaled`, but runs on a worker thread so that several
+        images can be downscaled in parallel."""
+        rendition = self._renditions.get(scale_factor)
+        if rendition is None:
+            rendition = await asyncio.to_thread(self.downscaled, scale_factor)
+        return rendition
+
+
+def downscale_jpeg(data, scale_factor):
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+
+    # Calculate the new size
+    width, height = img.size
+    new_size = (int(width * scale_factor), int(height * scale_factor))
+
+    # Let the JPEG decoder skip to the smallest scale (1/2, 1/4 or 1/8) that
+    # is still at least the new size. No-op for other formats.
+    img.draft('RGB', new_size)
+
+    # Resize the image
+    img_resized = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    # Convert the image to RGB if it's RGBA
+    if img_resized.mode == 'RGBA':
+        img_resized = img_resized.convert('RGB')
+
+    buffered = io.BytesIO()
+    img_resized.save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+def contact_sheet(images, labels, columns=3, label_height=28, padding=8):
+    """Tiles `images` into a single JPEG grid with each tile's label printed
+    below it, and returns it as an `ImageHandle`."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    tiles = [Image.open(io.BytesIO(image.data)).convert('RGB') for image in images]
+    cell_width = max(tile.width for tile in tiles) + padding
+    cell_height = max(tile.height for tile in tiles) + label_height + padding
+    rows = (len(tiles) + columns - 1) // columns
+    sheet = Image.new('RGB', (cell_width * columns, cell_height * rows),
+                      'white')
+    draw = ImageDraw.Draw(sheet)
+    font = ImageFont.load_default(size=label_height * 2 // 3)
+    for i, (tile, label) in enumerate(zip(tiles, labels)):
+        x = (i % columns) * cell_width
+        y = (i // columns) * cell_height
+        sheet.paste(tile, (x + (cell_width - tile.width) // 2, y + padding))
+        draw.text((x + cell_width // 2, y + cell_height - label_height // 2),
+                  label,
+                  fill='black',
+                  font=font,
+                  anchor='mm')
+
+    buffered = io.BytesIO()
+    sheet.save(buffered, format="JPEG")
+    return ImageHandle(buffered.getvalue(), "image/jpeg")
+
+
+class ImageStore:
+    """Content-addressed store of images, with ids being their digests.
+
+    Images are kept in a size-bounded `BlobCache`. The store also remembers
+    which image was fetched from which source URL, so a URL is only
+    downloaded again once its entry is evicted or older than `source_ttl`.
+    """
+
+    def __init__(self, blobs, max_sources=4096, source_ttl=3600.0):
+        self.blobs = blobs
+        self._sources = TTLCache(max_entries=max_sources, ttl=source_ttl)
+
+    def put(self, image, source_url=None):
+        """Stores `image` and returns its id."""
+        self.blobs.put(image.digest, image.data)
+        if source_url is not None:
+            self._sources.put(source_url, image.digest)
+        return image.digest
+
+    def get(self, image_id):
+        """Returns the stored image as an `ImageHandle`, or None."""
+        data = self.blobs.get(image_id)
+        if data is None:
+            return None
+        image = ImageHandle(data)
+        image._digest = image_id
+        return image
+
+    def get_source(self, source_url, renew=False):
+        """Returns the image fetched from `source_url`, or None if there is
+        none or it was fetched more than `source_ttl` seconds ago.
+
+        With `renew`, an image fetched longer ago is returned as well and
+        counts as fetched now. This is for URLs whose content never changes,
+        such as instabase uploads, which get a new path per upload.
+        """
+        image_id, fresh = self._sources.lookup(source_url)
+        if image_id is None or not (fresh or renew):
+            return None
+        image = self.get(image_id)
+        if image is not None and not fresh:
+            self._sources.put(source_url, image_id)
+        return image
+
+    def stats(self):
+        return {"images": self.blobs.stats(), "sources": self._sources.stats()}
@@ -0,0 +1,149 @@
+"""
+Scraping of instabase venue listings.
+
+Parsed listings are cached per room id. Once an entry goes stale it is
+revalidated with conditional requests (ETag / Last-Modified), so an unchanged
+listing costs two 304 responses instead of two full HTML downloads and
+re-parses.
+"""
+
+import asyncio
+import os
+from collections import namedtuple
+
+from cache import TTLCache
+from http_clients import get_client, register_client
+
+instabase_host = "https://www.instabase.jp"
+
+request_timeout = float(os.getenv("INSTABASE_TIMEOUT", "10"))
+
+# Heavy HTTP and parsing libraries are imported on first use to keep startup
+# fast.
+
+
+def create_instabase_client():
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("INSTABASE_MAX_CONNECTIONS", "10")),
+        max_keepalive_connections=int(
+            os.getenv("INSTABASE_MAX_KEEPALIVE", "10")))
+    return httpx.AsyncClient(timeout=httpx.Timeout(request_timeout,
+                                                   connect=5.0),
+                             limits=limits,
+                             follow_redirects=True)
+
+
+register_client("instabase", create_instabase_client)
+
+listing_cache = TTLCache(
+    max_entries=int(os.getenv("LISTING_CACHE_MAX_ENTRIES", "512")),
+    ttl=float(os.getenv("LISTING_CACHE_TTL", "300")))
+
+# A parsed page together with the validators needed to revalidate it
+CachedPage = namedtuple("CachedPage", ["etag", "last_modified", "value"])
+
+
+def parse_listing_images(html):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    dirs = filter(lambda x: x.startswith("/imgs/r/uploads/room_image/image/"),
+                  [
+                      img['src'].replace('medium', 'large')
+                      for img in soup.find_all('img')
+                  ])
+    return list(dict.fromkeys(dirs))
+
+
+def parse_listing_details(html):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    title = soup.find('h2', {'class': 'text-xl'}).text
+
+    div = soup.find_all('div', {'class': 'mt-6'})[2]
+    tags = [i.text for i in div.find_all('button')]
+
+    return title, tags
+
+
+def conditional_headers(cached_page):
+    headers = {}
+    if cached_page is None:
+        return headers
+    if cached_page.etag:
+        headers["If-None-Match"] = cached_page.etag
+    if cached_page.last_modified:
+        headers["If-Modified-Since"] = cached_page.last_modified
+    return headers
+
+
+def page_from_response(response, cached_page, parse):
+    """Turns a (possibly conditional) response into a CachedPage.
+
+    Returns the cached page unchanged on 304 and None on any other non-200.
+    """
+    if response.status_code == 304 and cached_page is not None:
+        return cached_page
+    if response.status_code != 200:
+        return None
+    return CachedPage(response.headers.get("ETag"),
+                      response.headers.get("Last-Modified"),
+                      parse(response.text))
+
+
+async def fetch_listing_page_async(client, url, cached_page, parse):
+    r = await client.get(url, headers=conditional_headers(cached_page))
+    # Parsing large pages takes a while, so it is kept off the event loop
+    return await asyncio.to_thread(page_from_response, r, cached_page, parse)
+
+
+def listing_from_pages(pages):
+    title, tags = pages["details"].value
+    return title, [
+        instabase_host + directory for directory in pages["images"].value
+    ], tags
+
+
+def store_listing_pages(room_id, cached_pages, pages):
+    if cached_pages and all(pages[k] is cached_pages.get(k) for k in pages):
+        listing_cache.record("revalidated")
+    listing_cache.put(str(room_id), pages)
+
+
+async def fetch_image_async(url):
+    """Downloads a listing image over the shared instabase connection pool."""
+    r = await get_client("instabase").get(url)
+    r.raise_for_status()
+    return r.content
+
+
+async def scrape_listing_async(room_id, max_age=None):
+    """Returns the title, image URLs and tags of a listing, fetching its
+    details and images pages concurrently over the shared instabase connection
+    pool. A cached listing older than `max_age` seconds (the cache TTL by
+    default) is revalidated."""
+    cached_pages, fresh = listing_cache.lookup(str(room_id), max_age)
+    if fresh:
+        return listing_from_pages(cached_pages)
+    cached_pages = cached_pages or {}
+
+    url = instabase_host + "/space/" + str(room_id)
+
+    client = get_client("instabase")
+    images, details = await asyncio.gather(
+        fetch_listing_page_async(client, url + "/images",
+                                 cached_pages.get("images"),
+                                 parse_listing_images),
+        fetch_listing_page_async(client, url, cached_pages.get("details"),
+                                 parse_listing_details))
+    if images is None or details is None:
+        return None, []
+
+    pages = {"images": images, "details": details}
+    store_listing_pages(room_id, cached_pages, pages)
+    return listing_from_pages(pages)
@@ -0,0 +1,241 @@
+"""
+Background jobs for long-running requests.
+
+Jobs are submitted to a bounded queue and processed by a fixed pool of worker
+threads, so the number of pipelines in flight is sized independently of the
+number of HTTP workers. Jobs and their results are stored in SQLite, which is
+the queue itself: workers of every process sharing the database poll it and
+claim queued jobs atomically. A running job is kept alive by its owner's
+heartbeat and is queued again once that stops for `lease` seconds (e.g. after
+a crash). Finished jobs are kept for `retention` seconds so clients can poll
+for the result.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobQueue:
+
+    def __init__(self,
+                 db_path,
+                 handlers,
+                 num_workers=2,
+                 max_queued=100,
+                 retention=3600.0,
+                 lease=60.0,
+                 poll_interval=1.0):
+        """
+        Args:
+          db_path: path of the SQLite database.
+          handlers: a dict mapping job kinds to functions that take the job
+            payload and return a JSON-serializable result.
+          num_workers: number of worker threads.
+          max_queued: maximum number of jobs waiting to be processed.
+          retention: seconds to keep finished jobs.
+          lease: seconds without a heartbeat after which a running job is
+            considered abandoned and queued again.
+          poll_interval: seconds between polls for queued jobs by idle
+            workers.
+        """
+        self.handlers = handlers
+        self.num_workers = num_workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.lease = lease
+        self.poll_interval = poll_interval
+        # Identifies this queue's running jobs among those of other processes
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self._submitted = threading.Condition()
+        self._lock = threading.Lock()
+        self._started = False
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                state TEXT NOT NULL,
+                payload TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                owner TEXT,
+                heartbeat_at REAL
+            )""")
+        # Databases created before jobs had owners
+        columns = {
+            row[1]
+            for row in self._db.execute("PRAGMA table_info(jobs)")
+        }
+        for column, column_type in (("owner", "TEXT"), ("heartbeat_at",
+                                                        "REAL")):
+            if column not in columns:
+                self._db.execute(
+                    f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+        self._db.commit()
+
+    def start(self):
+        """Starts the workers and the heartbeat of their running jobs.
+        Calling it again is a no-op."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.num_workers):
+            threading.Thread(target=self._work,
+                             name=f"job-worker-{i}",
+                             daemon=True).start()
+        threading.Thread(target=self._heartbeat,
+                         name="job-heartbeat",
+                         daemon=True).start()
+
+    def submit(self, kind, payload):
+        """Queues a job and returns its id.
+
+        Raises:
+          QueueFullError: if `max_queued` jobs are already waiting.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind {kind}")
+        self._purge_expired()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            queued, = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = ?",
+                (QUEUED, )).fetchone()
+            if queued >= self.max_queued:
+                raise QueueFullError(
+                    f"{self.max_queued} jobs are already queued")
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, state, payload, created_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), now, now))
+            self._db.commit()
+        # Wakes an idle worker of this process rather than waiting for its
+        # next poll
+        with self._submitted:
+            self._submitted.notify()
+        return job_id
+
+    def get(self, job_id):
+        """Returns the job as a dict, or None if it is unknown or expired."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, state, result, error, created_at, updated_at "
+                "FROM jobs WHERE id = ?", (job_id, )).fetchone()
+        if row is None:
+            return None
+        job_id, kind, state, result, error, created_at, updated_at = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "state": state,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def stats(self):
+        with self._lock:
+            counts = dict(
+                self._db.execute(
+                    "SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {
+            **{state: counts.get(state, 0)
+               for state in (QUEUED, RUNNING, SUCCEEDED, FAILED)},
+            "workers": self.num_workers,
+            "max_queued": self.max_queued,
+        }
+
+    def _finish(self, job_id, state, result=None, error=None):
+        with self._lock:
+            # The payload is no longer needed once the job has finished. A job
+            # whose lease was lost to another worker is left to that worker.
+            self._db.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, "
+                "payload = NULL, owner = NULL, updated_at = ? "
+                "WHERE id = ? AND state = ? AND owner = ?",
+                (state, json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id, RUNNING, self._owner))
+            self._db.commit()
+
+    def _claim(self):
+        """Claims the oldest queued job, first queueing again running jobs
+        whose lease has expired. Returns `(job_id, kind, payload)`, or None if
+        no job is queued."""
+        with self._lock:
+            now = time.time()
+            self._db.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, updated_at = ? "
+                "WHERE state = ? AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (QUEUED, now, RUNNING, now - self.lease))
+            self._db.commit()
+            while True:
+                row = self._db.execute(
+                    "SELECT id, kind, payload FROM jobs WHERE state = ? "
+                    "ORDER BY created_at LIMIT 1", (QUEUED, )).fetchone()
+                if row is None:
+                    return None
+                # Only one of the workers racing for the job (in any process)
+                # updates the row
+                claimed = self._db.execute(
+                    "UPDATE jobs SET state = ?, owner = ?, heartbeat_at = ?, "
+                    "updated_at = ? WHERE id = ? AND state = ?",
+                    (RUNNING, self._owner, now, now, row[0], QUEUED)).rowcount
+                self._db.commit()
+                if claimed:
+                    return row
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                self._db.execute(
+                    "UPDATE jobs SET heartbeat_at = ? WHERE state = ? "
+                    "AND owner = ?", (time.time(), RUNNING, self._owner))
+                self._db.commit()
+
+    def _purge_expired(self):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, FAILED, time.time() - self.retention))
+            self._db.commit()
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._submitted:
+                    self._submitted.wait(self.poll_interval)
+                continue
+            job_id, kind, payload = job
+            try:
+                result = self.handlers[kind](json.loads(payload))
+            except Exception as e:
+                print(f"Job {job_id} ({kind}) failed: {e}")
+                self._finish(job_id, FAILED, error=str(e))
+            else:
+                self._finish(job_id, SUCCEEDED, result=result)
+            self._purge_expired()
@@ -0,0 +1,143 @@
+"""
+Async access to the OpenAI API.
+
+Requests go through an `AsyncOpenAI` client backed by a shared, pooled httpx
+client (see `http_clients`), so LLM calls never block the event loop and can
+overlap with Stability traffic and with each other.
+
+Completions are cached on disk, keyed on the model, messages (with inline
+image data hashed) and parameters, so repeated queries for the same venue,
+trend or tags are answered without another round trip. Entries expire after
+`LLM_CACHE_TTL` seconds.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+
+from cache import BlobCache, content_key
+from http_clients import get_client, register_client
+
+
+def create_openai_http_client():
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE",
+                                                "20")))
+    return httpx.AsyncClient(timeout=httpx.Timeout(600.0, connect=5.0),
+                             limits=limits)
+
+
+register_client("openai", create_openai_http_client)
+
+# AsyncOpenAI wrappers around each shared httpx client
+_openai_clients = weakref.WeakKeyDictionary()
+
+
+def get_openai_client():
+    http_client = get_client("openai")
+    client = _openai_clients.get(http_client)
+    if client is None:
+        # Imported on first use: the openai package is slow to import
+        from openai import AsyncOpenAI
+
+        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"),
+                             http_client=http_client)
+        _openai_clients[http_client] = client
+    return client
+
+
+llm_cache_enabled = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+llm_cache_ttl = float(os.getenv("LLM_CACHE_TTL", "86400"))
+response_cache = BlobCache(
+    os.path.join(os.getenv("CACHE_DIR", ".cache"), "llm"),
+    max_memory_bytes=int(os.getenv("LLM_CACHE_MEMORY_MB", "16")) << 20,
+    max_disk_bytes=int(os.getenv("LLM_CACHE_DISK_MB", "256")) << 20)
+_cache_counters = {"hits": 0, "misses": 0, "expired": 0, "bypassed": 0}
+_cache_counters_lock = threading.Lock()
+
+
+def _record(counter):
+    with _cache_counters_lock:
+        _cache_counters[counter] += 1
+
+
+def _hash_inline_data(value):
+    """Replaces base64 data URLs (inline images) with their digest, so that
+    cache keys stay small."""
+    if isinstance(value, dict):
+        return {k: _hash_inline_data(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_hash_inline_data(v) for v in value]
+    if isinstance(value, str) and value.startswith("data:"):
+        return "sha256:" + hashlib.sha256(value.encode()).hexdigest()
+    return value
+
+
+def request_cache_key(kwargs):
+    return content_key(
+        json.dumps(_hash_inline_data(kwargs), sort_keys=True, default=str))
+
+
+def _load_cached_response(key):
+    from openai.types.chat import ChatCompletion
+
+    cached = response_cache.get(key)
+    if cached is None:
+        return None
+    entry = json.loads(cached)
+    if time.time() - entry["stored_at"] > llm_cache_ttl:
+        _record("expired")
+        return None
+    return ChatCompletion.model_validate(entry["response"])
+
+
+def _store_response(key, response):
+    response_cache.put(
+        key,
+        json.dumps({
+            "stored_at": time.time(),
+            "response": response.model_dump(mode="json"),
+        }).encode())
+
+
+async def chat_completion(use_cache=True, **kwargs):
+    """Creates a chat completion; takes the same arguments as
+    `client.chat.completions.create`.
+
+    With `use_cache=False` a cached response is ignored but refreshed.
+    Streaming requests are never cached.
+    """
+    if not llm_cache_enabled or kwargs.get("stream"):
+        return await get_openai_client().chat.completions.create(**kwargs)
+
+    key = request_cache_key(kwargs)
+    if use_cache:
+        response = await asyncio.to_thread(_load_cached_response, key)
+        if response is not None:
+            _record("hits")
+            return response
+        _record("misses")
+    else:
+        _record("bypassed")
+
+    response = await get_openai_client().chat.completions.create(**kwargs)
+    await asyncio.to_thread(_store_response, key, response)
+    return response
+
+
+def cache_stats():
+    with _cache_counters_lock:
+        counters = dict(_cache_counters)
+    lookups = counters["hits"] + counters["misses"]
+    return {
+        **counters,
+        "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+        "storage": response_cache.stats(),
+    }
@@ -0,0 +1,107 @@
+"""
+Background prewarming of frequently visited venues.
+
+A crawler on the shared event loop periodically runs the `/venue` pipeline
+for a watchlist of venue ids, so that the listing cache, the trend index and
+the LLM response cache are already warm when a user opens one of them.
+Crawls run with bounded concurrency and are rate limited, as every venue hits
+the same instabase host.
+"""
+
+import asyncio
+import threading
+import time
+
+from event_loop import get_loop
+from ratelimit import AsyncRateLimiter
+
+
+class Prewarmer:
+
+    def __init__(self,
+                 warm,
+                 age,
+                 venue_ids,
+                 interval=240.0,
+                 max_concurrency=2,
+                 rate=0.5):
+        """
+        Args:
+          warm: coroutine function taking a venue id that refreshes the
+            cached data for it.
+          age: function taking a venue id that returns the age in seconds of
+            its cached data, or None if nothing is cached.
+          venue_ids: the watchlist.
+          interval: seconds between the starts of two crawls of the
+            watchlist.
+          max_concurrency: maximum number of venues warmed at once.
+          rate: maximum number of venues started per second.
+        """
+        self.warm = warm
+        self.age = age
+        self.venue_ids = list(venue_ids)
+        self.interval = interval
+        self.limiter = AsyncRateLimiter(rate=rate,
+                                        burst=1,
+                                        max_concurrency=max_concurrency)
+        self._lock = threading.Lock()
+        self._started = False
+        self._counters = {
+            "passes": 0,
+            "crawls": 0,
+            "failures": 0,
+            "last_pass_seconds": 0.0,
+        }
+
+    def start(self):
+        """Starts crawling on the shared event loop. Calling it again, or
+        with an empty watchlist, is a no-op."""
+        with self._lock:
+            if self._started or not self.venue_ids:
+                return
+            self._started = True
+        asyncio.run_coroutine_threadsafe(self._crawl_forever(), get_loop())
+
+    async def _crawl_forever(self):
+        while True:
+            started_at = time.monotonic()
+            await asyncio.gather(
+                *(self._warm_venue(venue_id) for venue_id in self.venue_ids))
+            elapsed = time.monotonic() - started_at
+            with self._lock:
+                self._counters["passes"] += 1
+                self._counters["last_pass_seconds"] = elapsed
+            await asyncio.sleep(max(0.0, self.interval - elapsed))
+
+    async def _warm_venue(self, venue_id):
+        async with self.limiter:
+            try:
+                await self.warm(venue_id)
+            except Exception as e:
+                print(f"Prewarming venue {venue_id} failed: {e}")
+                with self._lock:
+                    self._counters["failures"] += 1
+                return
+        with self._lock:
+            self._counters["crawls"] += 1
+
+    def stats(self):
+        """Returns crawl counters, the throughput of the last pass in venues
+        per second and the freshness lag (age of the cached data) of the
+        watched venues."""
+        ages = [self.age(venue_id) for venue_id in self.venue_ids]
+        lags = [age for age in ages if age is not None]
+        with self._lock:
+            counters = dict(self._counters)
+        last_pass_seconds = counters["last_pass_seconds"]
+        return {
+            **counters,
+            "venues": len(self.venue_ids),
+            "unwarmed": len(self.venue_ids) - len(lags),
+            "throughput":
+            len(self.venue_ids) / last_pass_seconds
+            if last_pass_seconds else 0.0,
+            "max_lag": max(lags, default=0.0),
+            "mean_lag": sum(lags) / len(lags) if lags else 0.0,
+            "limiter": self.limiter.stats(),
+        }
@@ -0,0 +1,109 @@
+"""
+Rate limiting and retry helpers for calls to upstream APIs.
+"""
+
+import asyncio
+import email.utils
+import random
+import time
+
+
+class AsyncRateLimiter:
+    """Token bucket combined with a concurrency limit.
+
+    Use as `async with limiter: ...`. At most `max_concurrency` callers are
+    inside the block at once, and they enter at no more than `rate` per second
+    on average with bursts of up to `burst`. Must be used from a single event
+    loop.
+    """
+
+    def __init__(self, rate, burst, max_concurrency):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._not_before = 0.0
+        # Created lazily so it binds to the loop the limiter is used from
+        self._semaphore = None
+        self._counters = {
+            "acquired": 0,
+            "waiting": 0,
+            "in_flight": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def pause(self, seconds):
+        """Holds back all callers for `seconds`, e.g. after a 429."""
+        self._not_before = max(self._not_before, time.monotonic() + seconds)
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self._not_before:
+                await asyncio.sleep(self._not_before - now)
+                continue
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def __aenter__(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        started_at = time.monotonic()
+        self._counters["waiting"] += 1
+        try:
+            await self._semaphore.acquire()
+            try:
+                await self._take_token()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            self._counters["waiting"] -= 1
+        wait = time.monotonic() - started_at
+        self._counters["acquired"] += 1
+        self._counters["in_flight"] += 1
+        self._counters["total_wait"] += wait
+        self._counters["max_wait"] = max(self._counters["max_wait"], wait)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._counters["in_flight"] -= 1
+        self._semaphore.release()
+
+    def stats(self):
+        acquired = self._counters["acquired"]
+        return {
+            **self._counters,
+            "mean_wait":
+            self._counters["total_wait"] / acquired if acquired else 0.0,
+            "rate": self.rate,
+            "burst": self.burst,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with full jitter for the given 0-based retry."""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(value):
+    """Parses a Retry-After header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
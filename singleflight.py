@@ -0,0 +1,41 @@
+"""
+Coalescing of identical concurrent requests.
+
+When several requests with the same inputs arrive while the first one is
+still being computed, they all await that one computation and share its
+result (or exception) instead of each scraping, prompting and editing on
+their own.
+"""
+
+import asyncio
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls by key. Must be used from a single event
+    loop."""
+
+    def __init__(self):
+        self._calls = {}
+        self._counters = {"leaders": 0, "followers": 0}
+
+    async def do(self, key, fn):
+        """Returns the result of `fn()`, a zero-argument coroutine function,
+        sharing it with any concurrent call for the same `key`."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self._counters["leaders"] += 1
+        else:
+            self._counters["followers"] += 1
+        # A caller that goes away (e.g. a disconnected client) must not cancel
+        # the computation the other callers are waiting for
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self):
+        return {**self._counters, "in_flight": len(self._calls)}
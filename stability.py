@@ -0,0 +1,116 @@
+"""
+Requests to the Stability AI REST API.
+
+All calls go through one shared `httpx.AsyncClient` (see `http_clients`), so
+edits reuse warm keep-alive (or HTTP/2) connections instead of paying a
+TCP+TLS handshake each. Calls are throttled by a process-wide rate limiter
+and retried with jittered exponential backoff (honoring Retry-After) on
+throttling, server errors and connection failures.
+"""
+
+import asyncio
+import importlib.util
+import os
+
+from http_clients import get_client, register_client
+from ratelimit import AsyncRateLimiter, backoff_delay, parse_retry_after
+
+stability_ai_api_host = "https://api.stability.ai"
+
+
+def create_stability_client():
+    import httpx
+
+    # HTTP/2 needs the optional `h2` package; otherwise connections are
+    # still reused through HTTP/1.1 keep-alive.
+    http2 = (os.getenv("STABILITY_HTTP2", "1") == "1"
+             and importlib.util.find_spec("h2") is not None)
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("STABILITY_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(
+            os.getenv("STABILITY_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("STABILITY_KEEPALIVE_EXPIRY", "60")))
+    return httpx.AsyncClient(base_url=stability_ai_api_host,
+                             timeout=httpx.Timeout(30.0, connect=60.0),
+                             limits=limits,
+                             http2=http2)
+
+
+register_client("stability", create_stability_client)
+
+
+# Shared by all requests, so bursts of /edit traffic queue here instead of
+# fanning out into 429s
+stability_limiter = AsyncRateLimiter(
+    rate=float(os.getenv("STABILITY_RATE", "15")),
+    burst=int(os.getenv("STABILITY_BURST", "15")),
+    max_concurrency=int(os.getenv("STABILITY_MAX_CONCURRENCY", "12")))
+
+max_retries = int(os.getenv("STABILITY_MAX_RETRIES", "3"))
+backoff_base = float(os.getenv("STABILITY_BACKOFF_BASE", "1"))
+backoff_max = float(os.getenv("STABILITY_BACKOFF_MAX", "30"))
+
+retryable_status_codes = {408, 429, 500, 502, 503, 504}
+
+retry_counters = {"retries": 0, "retry_after_honored": 0, "failures": 0}
+
+
+class StabilityAPIError(Exception):
+
+    def __init__(self, status_code, text):
+        super().__init__(f"HTTP {status_code}: {text}")
+        self.status_code = status_code
+
+
+def stats():
+    return {**retry_counters, "limiter": stability_limiter.stats()}
+
+
+async def send_generation_request_async(host, params, image, accept="image/*"):
+    import httpx
+
+    headers = {
+        "Accept": accept,
+        "Authorization": f"Bearer {os.getenv('STABILITY_AI_API_KEY')}"
+    }
+
+    # Encode parameters
+    files = {'image': image}
+
+    # Send request
+    print(f"Sending REST request to {host}...")
+    client = get_client("stability")
+    for attempt in range(max_retries + 1):
+        response = None
+        retry_after = None
+        try:
+            async with stability_limiter:
+                response = await client.post(host,
+                                             headers=headers,
+                                             files=files,
+                                             data=params)
+        except httpx.TransportError as e:
+            if attempt == max_retries:
+                retry_counters["failures"] += 1
+                raise
+            print(f"Request to {host} failed ({e!r}), retrying...")
+        else:
+            if response.is_success:
+                return response
+            if (response.status_code not in retryable_status_codes
+                    or attempt == max_retries):
+                retry_counters["failures"] += 1
+                raise StabilityAPIError(response.status_code, response.text)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            print(f"Request to {host} returned HTTP {response.status_code}, "
+                  f"retrying...")
+
+        if retry_after is not None:
+            retry_counters["retry_after_honored"] += 1
+            delay = retry_after
+        else:
+            delay = backoff_delay(attempt, backoff_base, backoff_max)
+        if response is not None and response.status_code == 429:
+            stability_limiter.pause(delay)
+        retry_counters["retries"] += 1
+        await asyncio.sleep(delay)
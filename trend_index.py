@@ -0,0 +1,79 @@
+"""
+Persistent index of which trends a venue can host.
+
+Judging a venue photo against the trend list is a slow GPT-4V call, but its
+answer only changes when the photo or the trend list changes. Verdicts are
+stored per (venue id, first-image hash, trend), so a new photo invalidates a
+venue's entry and trends added to the list are the only ones that need to be
+evaluated for venues that are already indexed.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class TrendIndex:
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                venue_id TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                trend TEXT NOT NULL,
+                viable INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (venue_id, image_hash, trend)
+            )""")
+        self._db.commit()
+        self._counters = {"hits": 0, "partial": 0, "misses": 0}
+
+    def lookup(self, venue_id, image_hash, trends):
+        """Looks up the stored verdicts for `trends`.
+
+        Returns:
+          A `(viable, missing)` tuple: the trends stored as viable, and the
+          trends that have no verdict for this venue and image yet, both in
+          the order of `trends`.
+        """
+        with self._lock:
+            verdicts = dict(
+                self._db.execute(
+                    "SELECT trend, viable FROM verdicts WHERE venue_id = ? "
+                    "AND image_hash = ?", (str(venue_id), image_hash)))
+            missing = [trend for trend in trends if trend not in verdicts]
+            if not missing:
+                self._counters["hits"] += 1
+            elif len(missing) < len(trends):
+                self._counters["partial"] += 1
+            else:
+                self._counters["misses"] += 1
+        viable = [trend for trend in trends if verdicts.get(trend)]
+        return viable, missing
+
+    def store(self, venue_id, image_hash, evaluated, viable):
+        """Stores verdicts for the `evaluated` trends, of which `viable` can
+        be hosted. Verdicts for older images of the venue are dropped."""
+        viable = set(viable)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM verdicts WHERE venue_id = ? AND image_hash != ?",
+                (str(venue_id), image_hash))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO verdicts (venue_id, image_hash, trend, "
+                "viable, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(str(venue_id), image_hash, trend, int(trend in viable), now)
+                 for trend in evaluated])
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            venues, = self._db.execute(
+                "SELECT COUNT(DISTINCT venue_id) FROM verdicts").fetchone()
+            return {**self._counters, "venues": venues}